@@ -1,19 +1,19 @@
+import difflib
+import os
+import sys
+import pandas as pd
 import streamlit as st
 import yaml
 import uuid
 from collections import OrderedDict
 
-# Helper to load yaml and keep the order of keys
-def ordered_load(stream, Loader=yaml.SafeLoader, object_pairs_hook=OrderedDict):
-    class OrderedLoader(Loader):
-        pass
-    def construct_mapping(loader, node):
-        loader.flatten_mapping(node)
-        return object_pairs_hook(loader.construct_pairs(node))
-    OrderedLoader.add_constructor(
-        yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG,
-        construct_mapping)
-    return yaml.load(stream, OrderedLoader)
+# The build helpers live in scripts/, which is not a package.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts'))
+from build_cache import hash_parts
+from config_loader import load_yaml
+from config_deps import config_fingerprint, find_config_paths
+from derived_context import derive_context
+from template_env import create_policy_environment
 
 # Helper to dump yaml and keep the order of keys
 def ordered_dump(data, stream=None, Dumper=yaml.SafeDumper, **kwds):
@@ -29,18 +29,31 @@ def ordered_dump(data, stream=None, Dumper=yaml.SafeDumper, **kwds):
 
 CONFIG_PATH = 'conf/config.yaml'
 SCHEMA_PATH = 'conf/ui_schema.yaml'
+POLICY_DIR = 'policies'
+ORDER_PATH = 'conf/policy_order.yaml'
 
 # --- App Layout ---
 st.set_page_config(layout="wide")
 st.title("PolicyComposer Configuration Manager")
 st.write("A web interface to easily edit your `config.yaml` file. Make your changes and click 'Save Configuration' at the bottom. For more details, see the Configuration UI Manual.")
 
-def set_delete_flag(key, item_id):
-    st.session_state["delete_item_id"] = (key, item_id)
+def file_signature(path):
+    """Returns (mtime_ns, size) for a file; used as the cache key for its parsed content."""
+    st_result = os.stat(path)
+    return st_result.st_mtime_ns, st_result.st_size
+
+@st.cache_data(show_spinner=False)
+def load_config_file(path, signature):
+    """Parses the config. st.cache_data hands every session its own copy to edit."""
+    return load_yaml(path, ordered=True)
+
+@st.cache_resource(show_spinner=False)
+def load_schema_file(path, signature):
+    """Parses the UI schema once per file version. The schema is never modified, so it is shared."""
+    return load_yaml(path, ordered=True)
 
-# Process deletions before rendering
-if st.session_state.get("delete_item_id") is not None:
-    key, item_id = st.session_state.delete_item_id
+def delete_item(key, item_id):
+    """on_click callback for the Delete buttons. Removes the item before the next (fragment) rerun."""
     # Handle composite keys for nested lists (e.g., "approved_tools.collaboration")
     if '.' in key:
         parent_key, child_key = key.split('.', 1)
@@ -50,20 +63,17 @@ if st.session_state.get("delete_item_id") is not None:
     else: # Handle simple top-level lists
         target_list = st.session_state.config.get(key, [])
         st.session_state.config[key] = [obj for obj in target_list if obj.get("_id") != item_id]
-    del st.session_state["delete_item_id"]
 
 # --- Load Config and Schema ---
 # Use session state to preserve config across reruns from widget interactions
 if 'config' not in st.session_state:
     try:
-        with open(CONFIG_PATH, 'r') as f:
-            st.session_state.config = ordered_load(f)
+        st.session_state.config = load_config_file(CONFIG_PATH, file_signature(CONFIG_PATH))
     except FileNotFoundError:
         st.error(f"Configuration file not found at `{CONFIG_PATH}`. Please ensure it exists.")
         st.stop()
 try:
-    with open(SCHEMA_PATH, 'r') as f:
-        schema = ordered_load(f)
+    schema = load_schema_file(SCHEMA_PATH, file_signature(SCHEMA_PATH))
 except FileNotFoundError:
     st.error(f"UI Schema file not found at `{SCHEMA_PATH}`. The UI cannot be rendered.")
     st.stop()
@@ -85,21 +95,172 @@ def find_lists_for_id_backfill(schema_node):
     return keys
 
 # --- Data Backfilling ---
-# Ensure all list items have a unique ID for stable deletion.
-list_definitions = find_lists_for_id_backfill(schema)
-for definition in list_definitions:
-    key = definition['key']
-    if key in st.session_state.config:
-        if definition['type'] == 'list_of_objects' and isinstance(st.session_state.config[key], list):
-            for item in st.session_state.config[key]:
-                if '_id' not in item:
-                    item['_id'] = str(uuid.uuid4())
-        elif definition['type'] == 'dict_of_list_of_objects' and isinstance(st.session_state.config[key], dict):
-            for category_list in st.session_state.config[key].values():
-                if isinstance(category_list, list):
-                    for item in category_list:
-                        if '_id' not in item:
-                            item['_id'] = str(uuid.uuid4())
+# Ensure all list items have a unique ID for stable deletion. Done once per
+# session: items added later get their ID from the Add button.
+if not st.session_state.get('ids_backfilled'):
+    list_definitions = find_lists_for_id_backfill(schema)
+    for definition in list_definitions:
+        key = definition['key']
+        if key in st.session_state.config:
+            if definition['type'] == 'list_of_objects' and isinstance(st.session_state.config[key], list):
+                for item in st.session_state.config[key]:
+                    if '_id' not in item:
+                        item['_id'] = str(uuid.uuid4())
+            elif definition['type'] == 'dict_of_list_of_objects' and isinstance(st.session_state.config[key], dict):
+                for category_list in st.session_state.config[key].values():
+                    if isinstance(category_list, list):
+                        for item in category_list:
+                            if '_id' not in item:
+                                item['_id'] = str(uuid.uuid4())
+    st.session_state.ids_backfilled = True
+
+# --- Bulk Editor for Large Lists ---
+BULK_EDIT_THRESHOLD = 25 # Lists longer than this open in the bulk editor by default
+BULK_PAGE_SIZES = [25, 50, 100, 250]
+LIST_FIELD_WIDGETS = ("text_area", "multiselect")
+
+def object_list(key):
+    """Returns the list for a simple or composite ("approved_tools.collaboration") key."""
+    if '.' in key:
+        parent_key, child_key = key.split('.', 1)
+        return st.session_state.config.get(parent_key, {}).get(child_key, [])
+    return st.session_state.config.get(key, [])
+
+def bulk_cell(field_def, value):
+    """Converts a config value to a grid cell. List fields are edited as comma-separated text."""
+    if field_def.get("widget") in LIST_FIELD_WIDGETS:
+        return ", ".join(value) if isinstance(value, list) else ""
+    if field_def.get("widget") == "toggle":
+        return bool(value)
+    return "" if value is None else value
+
+def bulk_value(field_def, cell, original=None):
+    """Converts a grid cell back to a config value.
+
+    Text cells keep the type of the value they replace: a number stays a number
+    if the edit still parses as one, and clearing a number or null gives null.
+    """
+    if not isinstance(cell, (str, bool, list)) and pd.isna(cell):
+        cell = None # Empty cells in added rows
+    if field_def.get("widget") in LIST_FIELD_WIDGETS:
+        return [v.strip() for v in str(cell or "").split(",") if v.strip()]
+    if field_def.get("widget") == "toggle":
+        return bool(cell)
+    numeric = isinstance(original, (int, float)) and not isinstance(original, bool)
+    if cell is None or str(cell).strip() == "":
+        return None if original is None or numeric else ""
+    if numeric:
+        text = str(cell).strip()
+        for convert in (int, float):
+            try:
+                return convert(text)
+            except ValueError:
+                pass
+    return str(cell)
+
+def apply_bulk_edits(key, editor_key, page_ids, object_schema):
+    """on_click callback for the bulk editor's Apply button.
+
+    The editor state refers to rows by their position on the page, so page_ids
+    maps them back to the stable _id of each item. Deleted rows are removed by
+    _id and added rows get a new _id, as with the per-item Delete and Add buttons.
+    """
+    changes = st.session_state.get(editor_key, {})
+    target_list = object_list(key)
+    by_id = {item.get("_id"): item for item in target_list}
+    for position, edits in changes.get("edited_rows", {}).items():
+        item = by_id.get(page_ids[int(position)])
+        if item is not None:
+            for field_key, cell in edits.items():
+                if field_key in object_schema:
+                    item[field_key] = bulk_value(object_schema[field_key], cell, item.get(field_key))
+    deleted_ids = {page_ids[int(position)] for position in changes.get("deleted_rows", [])}
+    new_list = [item for item in target_list if item.get("_id") not in deleted_ids]
+    for row in changes.get("added_rows", []):
+        new_item = {"_id": str(uuid.uuid4())}
+        for field_key, field_def in object_schema.items():
+            # Compared with "", the Add button's default, so empty text cells stay "".
+            new_item[field_key] = bulk_value(field_def, row.get(field_key), "")
+        new_list.append(new_item)
+    target_list[:] = new_list
+    # A fresh editor key discards the applied edits, so they are not applied twice.
+    st.session_state[f"bulk_version_{key}"] = st.session_state.get(f"bulk_version_{key}", 0) + 1
+
+def bulk_matches(item, object_schema, search, field_filters):
+    if search:
+        text = " ".join(str(bulk_cell(field_def, item.get(field_key))) for field_key, field_def in object_schema.items()
+                        if field_def.get("widget") != "toggle")
+        if search.lower() not in text.lower():
+            return False
+    for field_key, wanted in field_filters.items():
+        value = item.get(field_key)
+        if object_schema[field_key].get("widget") == "toggle":
+            if bool(value) != (wanted == "Yes"):
+                return False
+        elif wanted not in (value or []):
+            return False
+    return True
+
+def render_bulk_editor(key, object_schema):
+    """Renders a list of objects as one paginated, filterable grid.
+
+    Only the current page is sent to the browser. Edits are collected in a form
+    and applied together when the Apply button is clicked.
+    """
+    target_list = object_list(key)
+    filter_cols = st.columns(1 + sum(1 for d in object_schema.values() if d.get("widget") in ("toggle", "multiselect")))
+    search = filter_cols[0].text_input("Search", key=f"bulk_search_{key}")
+    field_filters = {}
+    col_index = 1
+    for field_key, field_def in object_schema.items():
+        field_label = field_def.get("label", field_key)
+        if field_def.get("widget") == "toggle":
+            choice = filter_cols[col_index].selectbox(field_label, ["Any", "Yes", "No"], key=f"bulk_filter_{key}_{field_key}")
+        elif field_def.get("widget") == "multiselect":
+            choice = filter_cols[col_index].selectbox(field_label, ["Any"] + field_def.get("options", []), key=f"bulk_filter_{key}_{field_key}")
+        else:
+            continue
+        col_index += 1
+        if choice != "Any":
+            field_filters[field_key] = choice
+
+    matches = [item for item in target_list if bulk_matches(item, object_schema, search, field_filters)]
+    page_cols = st.columns(3)
+    page_size = page_cols[0].selectbox("Rows per page", BULK_PAGE_SIZES, key=f"bulk_page_size_{key}")
+    page_count = max(1, -(-len(matches) // page_size))
+    # The page lives only in session state; passing value= as well makes Streamlit warn.
+    page_key = f"bulk_page_{key}"
+    if page_key not in st.session_state:
+        st.session_state[page_key] = 1
+    elif st.session_state[page_key] > page_count:
+        st.session_state[page_key] = page_count # The filter left fewer pages
+    page = page_cols[1].number_input("Page", min_value=1, max_value=page_count, key=page_key)
+    start = (page - 1) * page_size
+    page_items = matches[start:start + page_size]
+    page_cols[2].caption(f"Showing {start + 1 if page_items else 0}–{start + len(page_items)} of {len(matches)} matching ({len(target_list)} total)")
+
+    column_config = {}
+    for field_key, field_def in object_schema.items():
+        field_label = field_def.get("label", field_key)
+        if field_def.get("widget") == "toggle":
+            column_config[field_key] = st.column_config.CheckboxColumn(field_label, default=False)
+        elif field_def.get("widget") == "multiselect":
+            column_config[field_key] = st.column_config.TextColumn(field_label, help="Comma-separated. Options: " + ", ".join(field_def.get("options", [])))
+        elif field_def.get("widget") == "text_area":
+            column_config[field_key] = st.column_config.TextColumn(field_label, help="Comma-separated.")
+        else:
+            column_config[field_key] = st.column_config.TextColumn(field_label)
+
+    rows = pd.DataFrame([{field_key: bulk_cell(field_def, item.get(field_key)) for field_key, field_def in object_schema.items()}
+                         for item in page_items], columns=list(object_schema))
+    page_ids = [item.get("_id") for item in page_items]
+    # Keyed on the page's items too: pending edits are positional, so they must
+    # not carry over to a different page or filter.
+    editor_key = f"bulk_editor_{key}_{st.session_state.get(f'bulk_version_{key}', 0)}_{hash_parts(*page_ids)[:12]}"
+    with st.form(f"bulk_form_{key}", border=False):
+        st.data_editor(rows, column_config=column_config, column_order=list(object_schema), num_rows="dynamic",
+                       hide_index=True, use_container_width=True, key=editor_key)
+        st.form_submit_button("Apply changes", on_click=apply_bulk_edits, args=(key, editor_key, page_ids, object_schema))
 
 def render_widget(key, definition, data_node):
     """Renders a single widget based on the schema definition."""
@@ -223,6 +384,10 @@ def render_widget(key, definition, data_node):
 
         object_schema = definition.get("_object_schema", {})
 
+        if st.toggle("Bulk edit", value=len(target_list) > BULK_EDIT_THRESHOLD, key=f"bulk_mode_{key}"):
+            render_bulk_editor(key, object_schema)
+            return
+
         # Display existing items with edit/delete options
         for i, item in enumerate(target_list):
             with st.container(border=True):
@@ -257,7 +422,7 @@ def render_widget(key, definition, data_node):
                         key=f"delete_{key}_{item_id}",
                         type="secondary",
                         use_container_width=True,
-                        on_click=set_delete_flag,
+                        on_click=delete_item,
                         args=(key, item_id)
                     )
 
@@ -268,7 +433,7 @@ def render_widget(key, definition, data_node):
             for k, v in object_schema.items():
                 new_item[k] = [] if v.get('widget') in ['text_area', 'multiselect'] else ""
             target_list.append(new_item)
-            st.rerun()
+            st.rerun(scope="fragment")
         
     elif widget_type == "dict_of_list_of_objects":
         # Special widget for a dict of lists of objects (like approved_tools)
@@ -276,11 +441,16 @@ def render_widget(key, definition, data_node):
             data_node[key] = {}
         target_dict = data_node[key]
         object_schema = definition.get("_object_schema", {})
+        longest = max((len(v) for v in target_dict.values() if isinstance(v, list)), default=0)
+        bulk_mode = st.toggle("Bulk edit", value=longest > BULK_EDIT_THRESHOLD, key=f"bulk_mode_{key}")
 
         for category, item_list in target_dict.items():
             st.subheader(f"{category.replace('_', ' ').title()} Tools")
             if not isinstance(item_list, list):
                 continue
+            if bulk_mode:
+                render_bulk_editor(f"{key}.{category}", object_schema)
+                continue
 
             for i, item in enumerate(item_list):
                 with st.container(border=True):
@@ -309,7 +479,7 @@ def render_widget(key, definition, data_node):
                             key=f"delete_{category}_{item_id}",
                             type="secondary",
                             use_container_width=True,
-                            on_click=set_delete_flag,
+                            on_click=delete_item,
                             args=(f"{key}.{category}", item_id) # Pass a composite key
                         )
             
@@ -320,13 +490,15 @@ def render_widget(key, definition, data_node):
                 for k, v in object_schema.items():
                     new_item[k] = [] if v.get('widget') in ['text_area', 'multiselect'] else ""
                 item_list.append(new_item)
-                st.rerun()
+                st.rerun(scope="fragment")
     else:
         # This can be expanded to handle more complex types like list_of_objects
         pass
 
 # --- Main UI Rendering Loop ---
-for section_key, section_def in schema.items():
+@st.fragment
+def render_section(section_key, section_def):
+    """Renders one schema section. As a fragment, a widget change reruns only this section."""
     widget = section_def.get("_widget", "container")
     label = section_def.get("_label", section_key.replace('_', ' ').title())
     help_text = section_def.get("_help")
@@ -363,6 +535,114 @@ for section_key, section_def in schema.items():
             for key in column_keys:
                 render_widget(key, section_def[key], st.session_state.config)
 
+for section_key, section_def in schema.items():
+    render_section(section_key, section_def)
+
+# --- Policy Preview ---
+@st.cache_resource(show_spinner=False)
+def get_policy_env():
+    """The same Jinja environment (and bytecode cache) that process_policies.py renders with."""
+    return create_policy_environment(POLICY_DIR)
+
+@st.cache_resource(show_spinner=False)
+def template_config_paths(name, signature):
+    """Returns the config paths a template reads, parsed once per template version."""
+    env = get_policy_env()
+    source = env.loader.get_source(env, name)[0]
+    return sorted(find_config_paths(env.parse(source)))
+
+@st.cache_data(show_spinner=False)
+def load_policy_titles(path, signature):
+    """Returns [(source, title)] from policy_order.yaml."""
+    order = load_yaml(path) or {}
+    return [(entry['source'], entry.get('title', entry['source'])) for entry in order.get('policy_files', [])]
+
+@st.cache_data(max_entries=1024, show_spinner=False)
+def render_policy(name, template_signature, inputs_key, _context):
+    """Renders a policy. Keyed on the template version and the values of the config paths it reads.
+
+    _context is not part of the cache key (Streamlit skips arguments starting with
+    an underscore); inputs_key stands in for the parts of it the template uses.
+    """
+    try:
+        return get_policy_env().get_template(name).render(_context)
+    except Exception as e:
+        return f"**Could not render `{name}`:** {e}"
+
+@st.cache_resource(show_spinner=False)
+def saved_context(path, signature):
+    """The render context of the saved config, derived once per file version. Shared, so never modified."""
+    return derive_context(load_yaml(path, ordered=True))
+
+def preview_inputs_key(name, signature, context):
+    """Hashes the values of the config paths a template reads."""
+    paths = template_config_paths(name, signature)
+    return hash_parts(*[config_fingerprint(context, path) for path in paths])
+
+def render_preview_for(name, context):
+    signature = file_signature(os.path.join(POLICY_DIR, name))
+    return render_policy(name, signature, preview_inputs_key(name, signature, context), context)
+
+@st.cache_data(max_entries=1024, show_spinner=False)
+def policy_diff(name, template_signature, saved_key, current_key, _saved_context, _context):
+    """Diffs a policy rendered from the saved and the unsaved config. Keyed like render_policy()."""
+    saved = render_policy(name, template_signature, saved_key, _saved_context).splitlines()
+    current = render_policy(name, template_signature, current_key, _context).splitlines()
+    return "\n".join(difflib.unified_diff(saved, current, f"{name} (saved)", f"{name} (unsaved)", lineterm=""))
+
+def preview_diff(name, saved_context, context):
+    """Returns the diff for one policy; an idle refresh only hashes the config values it reads."""
+    signature = file_signature(os.path.join(POLICY_DIR, name))
+    saved_key = preview_inputs_key(name, signature, saved_context)
+    current_key = preview_inputs_key(name, signature, context)
+    if saved_key == current_key:
+        return "" # The template reads no edited value
+    return policy_diff(name, signature, saved_key, current_key, saved_context, context)
+
+def render_preview():
+    """Shows one policy rendered from the unsaved config, or the diff of every policy against the saved config."""
+    policies = load_policy_titles(ORDER_PATH, file_signature(ORDER_PATH))
+    titles = dict(policies)
+    mode = st.radio("Show", ["Rendered policy", "Changes in one policy", "Changes in all policies"], key="preview_mode")
+    # Derived indexes such as vendors_by_service are computed once per refresh, as in the build.
+    context = derive_context(st.session_state.config)
+
+    if mode == "Changes in all policies":
+        saved = saved_context(CONFIG_PATH, file_signature(CONFIG_PATH))
+        changed = 0
+        for name, title in policies:
+            diff = preview_diff(name, saved, context)
+            if diff:
+                changed += 1
+                with st.expander(title):
+                    st.code(diff, language="diff")
+        if not changed:
+            st.info("No policy changes compared with the saved configuration.")
+        return
+
+    name = st.selectbox("Policy", [source for source, _ in policies], format_func=titles.get, key="preview_policy")
+    if not name:
+        return
+    if mode == "Rendered policy":
+        with st.container(height=700):
+            st.markdown(render_preview_for(name, context))
+    else:
+        saved = saved_context(CONFIG_PATH, file_signature(CONFIG_PATH))
+        diff = preview_diff(name, saved, context)
+        if diff:
+            st.code(diff, language="diff")
+        else:
+            st.info("This policy is unchanged compared with the saved configuration.")
+
+with st.sidebar:
+    st.header("Policy Preview")
+    st.caption("Rendered from the unsaved configuration, without the version history table.")
+    if st.toggle("Show preview", key="preview_enabled"):
+        # Sections rerun on their own, so the preview refreshes itself. Renders are
+        # cached by the config values each template reads, so a refresh with no
+        # relevant change costs only a few hashes.
+        st.fragment(render_preview, run_every=2)()
+
 # --- Save Button ---
 st.divider()
 if st.button("💾 Save Configuration", type="primary"):
@@ -0,0 +1,294 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import yaml
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(SCRIPTS_DIR)
+
+SERVICES = ['Security', 'Platform', 'Monitoring', 'Data Storage', 'Hosting', 'Email', 'Analytics']
+FRAMEWORKS = ['hipaa', 'soc2', 'hitrust']
+SERVICE_TYPES = ['saas', 'paas', 'medical_device', 'mobile_app']
+
+# A pandoc stand-in that only writes its input to the output file, so the
+# build can be timed without LaTeX dominating every number.
+STUB_PANDOC = """#!/usr/bin/env python3
+import json
+import sys
+args = sys.argv[1:]
+if '--version' in args:
+    print('pandoc-stub 0.0')
+    sys.exit(0)
+out = args[args.index('-o') + 1] if '-o' in args else None
+data = sys.stdin.buffer.read() if not sys.stdin.isatty() else b''
+if '--to=json' in args:
+    # Wrap the input in a raw block so the writers still get something to copy.
+    print(json.dumps({'pandoc-api-version': [1, 23], 'meta': {},
+                      'blocks': [{'t': 'RawBlock', 'c': ['markdown', data.decode('utf-8')]}]}))
+elif out:
+    with open(out, 'wb') as f:
+        f.write(data)
+"""
+
+
+def synthetic_policy(index, rng):
+    """Returns a policy template with roughly the Jinja density of the files in policies/."""
+    sections = [f"# Synthetic Policy {index}\n\n{{{{ company_name }}}} maintains this policy for {{{{ company_service }}}}.\n"]
+    for section in range(rng.randint(6, 12)):
+        framework = rng.choice(FRAMEWORKS)
+        service_type = rng.choice(SERVICE_TYPES)
+        service = rng.choice(SERVICES)
+        sections.append(
+            f"\n## {index}.{section} Controls\n\n"
+            f"{{% if compliance_frameworks.{framework}.supported %}}\n"
+            f"{{{{ company }}}} applies the {framework.upper()} safeguards described here. "
+            f"Questions go to {{{{ security_officer_name }}}} at {{{{ security_officer_email }}}}.\n"
+            f"{{% endif %}}\n"
+            f"{{% if service_types.{service_type}.enabled %}}\n"
+            f"* The {service_type} offering follows this control.\n"
+            f"{{% endif %}}\n"
+            f"\n{{% for vendor in vendors_by_service['{service}'] %}}\n"
+            f"* {{{{ vendor.name }}}}{{% if vendor.baa_signed %}} (BAA signed){{% endif %}}\n"
+            f"{{% endfor %}}\n"
+        )
+    return ''.join(sections)
+
+
+def synthetic_config(base_config, vendor_count, rng):
+    """Returns the repo's config with its vendor list replaced by vendor_count generated vendors."""
+    config = dict(base_config)
+    config['vendors'] = [
+        {
+            'name': f"Vendor {i}",
+            'services': rng.sample(SERVICES, rng.randint(1, 3)),
+            'baa_signed': rng.random() < 0.5,
+        }
+        for i in range(vendor_count)
+    ]
+    return config
+
+
+def fast_import_stream(files, policy_paths, commit_count, rng):
+    """Builds a git fast-import stream: one commit adding every file, then commit_count edits."""
+    contents = dict(files)
+    stamp = 1700000000
+    out = io.BytesIO()
+
+    def write_commit(mark, message, changed):
+        nonlocal stamp
+        stamp += 3600
+        out.write(f"commit refs/heads/main\nmark :{mark}\n".encode())
+        out.write(f"author Bench Author <bench@example.com> {stamp} +0000\n".encode())
+        out.write(f"committer Bench Author <bench@example.com> {stamp} +0000\n".encode())
+        msg = message.encode()
+        out.write(f"data {len(msg)}\n".encode() + msg + b"\n")
+        if mark > 1:
+            out.write(f"from :{mark - 1}\n".encode())
+        for path in changed:
+            data = contents[path].encode()
+            out.write(f"M 100644 inline {path}\ndata {len(data)}\n".encode() + data + b"\n")
+        out.write(b"\n")
+
+    write_commit(1, "Initial import", sorted(contents))
+    for i in range(commit_count):
+        path = rng.choice(policy_paths)
+        contents[path] += f"\nRevision note {i}.\n"
+        prefix = 'RELEASE: ' if rng.random() < 0.2 else ''
+        write_commit(i + 2, f"{prefix}Update {os.path.basename(path)} ({i})", [path])
+    return out.getvalue()
+
+
+def create_workspace(root, policy_count, vendor_count, commit_count, seed):
+    """Creates a throwaway repository with the synthetic policies, config and history."""
+    rng = random.Random(seed)
+    with open(os.path.join(REPO_DIR, 'conf', 'config.yaml'), 'r') as f:
+        base_config = yaml.safe_load(f)
+
+    files = {}
+    order = []
+    for i in range(policy_count):
+        name = f"synthetic_policy_{i:03d}.md"
+        files[f"policies/{name}"] = synthetic_policy(i, rng)
+        order.append({'source': name, 'output': name, 'title': f"Synthetic Policy {i}"})
+    files['conf/config.yaml'] = yaml.safe_dump(synthetic_config(base_config, vendor_count, rng), sort_keys=False)
+    files['conf/policy_order.yaml'] = yaml.safe_dump({'policy_files': order}, sort_keys=False)
+    with open(os.path.join(REPO_DIR, 'conf', 'ui_schema.yaml'), 'r') as f:
+        files['conf/ui_schema.yaml'] = f.read()
+    files['conf/usermap.json'] = json.dumps({'Bench Author': 'Benchmark Author'})
+
+    subprocess.run(['git', 'init', '-q', root], check=True)
+    stream = fast_import_stream(files, [p for p in files if p.startswith('policies/')], commit_count, rng)
+    subprocess.run(['git', 'fast-import', '--quiet'], input=stream, cwd=root, check=True)
+    subprocess.run(['git', 'checkout', '-q', '-f', 'main'], cwd=root, check=True)
+
+
+def time_runs(repeat, func):
+    """Calls func repeat times and returns the wall-clock durations in seconds."""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def result(name, durations, **extra):
+    return {
+        'name': name,
+        'repeat': len(durations),
+        'min_s': round(min(durations), 6),
+        'median_s': round(statistics.median(durations), 6),
+        'max_s': round(max(durations), 6),
+        **extra,
+    }
+
+
+def run_script(workspace, script, script_args, env):
+    cmd = [sys.executable, os.path.join(SCRIPTS_DIR, script)] + script_args
+    completed = subprocess.run(cmd, cwd=workspace, env=env, capture_output=True, text=True, stdin=subprocess.DEVNULL)
+    if completed.returncode != 0:
+        raise RuntimeError(f"{script} {' '.join(script_args)} failed:\n{completed.stdout}\n{completed.stderr}")
+
+
+def check_release_delta(workspace, env, jobs):
+    """Builds two global releases with no edits in between and returns the second one's result.
+
+    Each release stamps its commit into every history table, but that alone
+    must not make release_delta.py publish anything again. Raises RuntimeError
+    if it does.
+    """
+    release_dir = os.path.join(workspace, '.bench-release')
+    durations = []
+    previous_args = []
+    for tag in ['r1', 'r2']:
+        if previous_args:
+            subprocess.run(['git', '-c', 'user.name=Bench Author', '-c', 'user.email=bench@example.com',
+                            'commit', '-q', '--allow-empty', '-m', f"Release {tag}"], cwd=workspace, check=True)
+        release_env = dict(env, IS_GLOBAL_RELEASE='true', CURRENT_COMMIT_SHA=subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=workspace, capture_output=True, text=True).stdout.strip())
+        start = time.perf_counter()
+        run_script(workspace, 'get_git_history.py', [], release_env)
+        run_script(workspace, 'process_policies.py', jobs, release_env)
+        run_script(workspace, 'release_delta.py', ['--tag', tag, '--dest', os.path.join(release_dir, tag)] + previous_args, release_env)
+        durations.append(time.perf_counter() - start)
+        previous_args = ['--previous', os.path.join(release_dir, tag, 'manifest.json')]
+
+    with open(os.path.join(release_dir, 'r2', 'manifest.json'), 'r') as f:
+        artifacts = json.load(f)['artifacts']
+    republished = [entry['path'] for entry in artifacts if entry['release'] == 'r2']
+    if republished:
+        raise RuntimeError(f"A global release with no edits published {len(republished)} of {len(artifacts)} "
+                           f"artifact(s) again, e.g. {', '.join(republished[:3])}")
+    return result('release.unchanged', durations[1:], artifacts=len(artifacts), published=0)
+
+
+def run_benchmarks(workspace, args):
+    env = dict(os.environ)
+    env.update({
+        'CURRENT_COMMIT_SHA': subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=workspace,
+                                             capture_output=True, text=True).stdout.strip(),
+        'CURRENT_COMMIT_ACTOR': 'Bench Author',
+        'CURRENT_COMMIT_MSG': 'Benchmark build',
+        'IS_GLOBAL_RELEASE': 'false',
+    })
+    if not args.real_pandoc:
+        bin_dir = os.path.join(workspace, '.bench-bin')
+        os.makedirs(bin_dir)
+        stub = os.path.join(bin_dir, 'pandoc')
+        with open(stub, 'w') as f:
+            f.write(STUB_PANDOC)
+        os.chmod(stub, 0o755)
+        env['PATH'] = bin_dir + os.pathsep + env.get('PATH', '')
+
+    results = []
+    for mode, mode_args in [('per-file', []), ('single-pass', ['--single-pass'])]:
+        durations = time_runs(args.repeat, lambda: run_script(workspace, 'get_git_history.py', mode_args, env))
+        results.append(result(f"git_history.{mode}", durations))
+
+    jobs = ['--jobs', str(args.jobs)]
+    durations = time_runs(args.repeat, lambda: run_script(workspace, 'process_policies.py', jobs + ['--no-cache'], env))
+    results.append(result('build.cold', durations, jobs=args.jobs, pandoc='real' if args.real_pandoc else 'stub'))
+    # Every input is unchanged after the cold runs, so this measures the incremental path.
+    durations = time_runs(args.repeat, lambda: run_script(workspace, 'process_policies.py', jobs, env))
+    results.append(result('build.incremental', durations, jobs=args.jobs, pandoc='real' if args.real_pandoc else 'stub'))
+    # The in-process HTML backend alone, which needs neither pandoc nor LaTeX.
+    durations = time_runs(args.repeat, lambda: run_script(workspace, 'process_policies.py', jobs + ['--no-cache', '--backend', 'html'], env))
+    results.append(result('build.html', durations, jobs=args.jobs))
+
+    # The validator is timed in-process; it resolves its paths against the cwd.
+    sys.path.insert(0, SCRIPTS_DIR)
+    from validate_config import ConfigValidator
+    previous_cwd = os.getcwd()
+    os.chdir(workspace)
+    try:
+        def validate():
+            with contextlib.redirect_stdout(io.StringIO()):
+                ConfigValidator(os.path.join('conf', 'config.yaml')).validate()
+        results.append(result('validator.validate', time_runs(args.repeat, validate)))
+    finally:
+        os.chdir(previous_cwd)
+    # The same check as CI and the pre-commit hook run it, interpreter start-up included.
+    durations = time_runs(args.repeat, lambda: run_script(workspace, 'validate_config.py', [], env))
+    results.append(result('validator.script', durations))
+
+    # Last, as it commits to the workspace.
+    results.append(check_release_delta(workspace, env, jobs))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the build, history and validation scripts on a synthetic workload.")
+    parser.add_argument('--policies', type=int, default=35, help="Number of synthetic policy templates (default: %(default)s).")
+    parser.add_argument('--vendors', type=int, default=200, help="Number of vendors in the synthetic config (default: %(default)s).")
+    parser.add_argument('--commits', type=int, default=500, help="Number of commits in the synthetic git history (default: %(default)s).")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per measurement (default: %(default)s).")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help="--jobs passed to process_policies.py.")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed for the workload (default: %(default)s).")
+    parser.add_argument('--real-pandoc', action='store_true', help="Use the installed pandoc instead of the stub.")
+    parser.add_argument('--output', help="Write the JSON results to this file instead of stdout.")
+    parser.add_argument('--keep', action='store_true', help="Keep the generated workspace and print its path.")
+    args = parser.parse_args()
+
+    workspace = tempfile.mkdtemp(prefix='policycomposer-bench-')
+    try:
+        create_workspace(workspace, args.policies, args.vendors, args.commits, args.seed)
+        results = run_benchmarks(workspace, args)
+    finally:
+        if args.keep:
+            print(f"Workspace kept at {workspace}", file=sys.stderr)
+        else:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+    report = {
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'parameters': {
+            'policies': args.policies, 'vendors': args.vendors, 'commits': args.commits,
+            'repeat': args.repeat, 'jobs': args.jobs, 'seed': args.seed,
+            'pandoc': 'real' if args.real_pandoc else 'stub',
+        },
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import argparse
+import atexit
+import os
+from build_trace import Tracer
+from policy_build import CONFIG_PATH, Builder, PolicyBuildError, add_build_arguments, build_options
+from template_env import precompile_templates
+import policycomposer
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export the history, validate the config and build every document in one process.")
+    parser.add_argument('--config', default=CONFIG_PATH, help=f"Config file to build (default: {CONFIG_PATH}).")
+    parser.add_argument('--history', choices=['auto', 'git', 'file', 'none'], default='auto',
+                        help="'git' exports the history from the repository (needs the CURRENT_COMMIT_* variables), "
+                             "'file' reads build/git_history.sqlite, 'none' builds without version history. "
+                             "'auto' uses 'git' when CURRENT_COMMIT_SHA is set, otherwise 'file' (default: %(default)s).")
+    parser.add_argument('--skip-validation', action='store_true', help="Do not run the config validator first.")
+    add_build_arguments(parser)
+    args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+
+    history = args.history
+    if history == 'auto':
+        history = 'git' if os.environ.get('CURRENT_COMMIT_SHA') else 'file'
+
+    tracer = Tracer(args.trace, trace_memory=args.trace_memory)
+    atexit.register(tracer.finish)
+
+    if args.precompile_templates:
+        builder = Builder(tracer=tracer, **build_options(args))
+        failures = precompile_templates(builder.env)
+        for name, e in failures:
+            print(f"ERROR: Could not compile {name}: {e}")
+        print(f"Precompiled {len(builder.env.list_templates(extensions=['md'])) - len(failures)} policy templates.")
+        exit(1 if failures else 0)
+
+    print("Starting policy build process...")
+    try:
+        policycomposer.build(
+            config_path=args.config, history=history, check_config=not args.skip_validation, plan_only=args.plan,
+            tracer=tracer, **build_options(args),
+        )
+    except PolicyBuildError as e:
+        print(f"ERROR: {e}")
+        exit(1)
+    print("Policy build process completed successfully.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+
+DEFAULT_CACHE_DIR = os.path.join('build', 'cache')
+DEFAULT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+
+def hash_parts(*parts):
+    """Returns a sha256 hex digest over an ordered list of str/bytes/list parts."""
+    digest = hashlib.sha256()
+    for part in parts:
+        if part is None:
+            part = b''
+        elif isinstance(part, (list, tuple)):
+            part = '\0'.join(str(p) for p in part)
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        # Length-prefix every part so ('ab', 'c') and ('a', 'bc') differ.
+        digest.update(f"{len(part)}:".encode('ascii'))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def hash_file(path):
+    """Returns the sha256 of a file's content, or '' if it does not exist."""
+    if not path or not os.path.exists(path):
+        return ''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BuildCache:
+    """A content-addressed, size-bounded store of built artifacts.
+
+    Artifacts are stored as build/cache/<key[:2]>/<key><suffix>. A hit copies
+    the stored file to the requested output path and refreshes its mtime, so
+    evict() can drop the least recently used entries first.
+
+    With a remote (see remote_cache.py), a local miss is looked up there and a
+    remote hit is kept locally; new entries are uploaded as they are stored.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MAX_BYTES, enabled=True, remote=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.remote = remote if enabled else None
+        self.hits = 0
+        self.misses = 0
+        self.remote_hits = 0 # Included in hits
+        self.lock = threading.Lock() # Build workers share one cache
+        if self.enabled:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _entry_path(self, key, suffix):
+        return os.path.join(self.cache_dir, key[:2], key + suffix)
+
+    def fetch(self, key, dest_path):
+        """Copies the cached artifact for key to dest_path. Returns True on a hit."""
+        if not self.enabled:
+            return False
+        suffix = os.path.splitext(dest_path)[1]
+        entry = self._entry_path(key, suffix)
+        try:
+            shutil.copyfile(entry, dest_path)
+            os.utime(entry)
+        except OSError:
+            data = self._fetch_remote(key, suffix)
+            if data is None:
+                return False
+            with open(dest_path, 'wb') as f:
+                f.write(data)
+            return True
+        with self.lock:
+            self.hits += 1
+        return True
+
+    def store(self, key, src_path):
+        """Adds a freshly built artifact to the cache."""
+        if not self.enabled or not os.path.exists(src_path):
+            return
+        suffix = os.path.splitext(src_path)[1]
+        self._write_entry(self._entry_path(key, suffix), lambda tmp_path: shutil.copyfile(src_path, tmp_path))
+        if self.remote is not None and not self.remote.read_only: # Skip reading the file back
+            with open(src_path, 'rb') as f:
+                self.remote.put(key + suffix, f.read())
+
+    def read(self, key, suffix):
+        """Returns the cached bytes for key, or None on a miss."""
+        if not self.enabled:
+            return None
+        entry = self._entry_path(key, suffix)
+        try:
+            with open(entry, 'rb') as f:
+                data = f.read()
+            os.utime(entry)
+        except OSError:
+            return self._fetch_remote(key, suffix)
+        with self.lock:
+            self.hits += 1
+        return data
+
+    def write(self, key, suffix, data):
+        """Stores bytes under key, e.g. an intermediate result that is not an output file."""
+        if not self.enabled:
+            return
+        self._write_bytes(self._entry_path(key, suffix), data)
+        if self.remote is not None:
+            self.remote.put(key + suffix, data)
+
+    def _fetch_remote(self, key, suffix):
+        """Counts a local miss. Returns the remote's bytes for key and keeps a local copy, or None."""
+        data = self.remote.get(key + suffix) if self.remote is not None else None
+        with self.lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.remote_hits += 1
+        if data is not None:
+            self._write_bytes(self._entry_path(key, suffix), data)
+        return data
+
+    def _write_bytes(self, entry, data):
+        def write_data(tmp_path):
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+        self._write_entry(entry, write_data)
+
+    def _write_entry(self, entry, fill):
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        # Write to a temp file and rename so concurrent workers never see a partial entry.
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(entry), suffix='.tmp')
+        os.close(fd)
+        try:
+            fill(tmp_path)
+            os.replace(tmp_path, entry)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def evict(self):
+        """Removes least recently used entries until the cache fits in max_bytes.
+
+        Returns the number of entries removed.
+        """
+        if not self.enabled:
+            return 0
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
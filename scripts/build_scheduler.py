@@ -0,0 +1,256 @@
+import itertools
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+DEFAULT_COSTS_FILE = os.path.join('build', 'job_costs.json')
+JOB_COSTS_VERSION = 1
+
+# Estimates for jobs that have never been measured, by the part of the key before
+# the first ':'. xelatex typically needs a few hundred MB for one policy and
+# more for the combined manual.
+DEFAULT_COSTS = {
+    'document': (3.0, 250),
+    'combined': (30.0, 600),
+}
+
+_current = threading.local()
+
+
+def _peak_rss_mb(rusage):
+    # ru_maxrss is in KB on Linux and in bytes on macOS.
+    return rusage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def _drain(stream, data, chunks):
+    """Writes data to stream, or reads stream into chunks, then closes it."""
+    try:
+        if data is not None:
+            stream.write(data)
+        else:
+            chunks.append(stream.read())
+    except BrokenPipeError:
+        pass # The child exited without reading all of its input
+    finally:
+        stream.close()
+
+
+def run_measured(cmd, input_text=None):
+    """Like subprocess.run(cmd, input=input_text, check=True, capture_output=True, text=True).stdout.
+
+    When called inside a Scheduler job, the child's peak RSS is added to the job's usage.
+    It comes from wait4(), which reports the larger of the child's own peak RSS
+    and that of the processes it waited for, so a pandoc run includes its xelatex.
+    """
+    stdin = subprocess.PIPE if input_text is not None else None
+    process = subprocess.Popen(cmd, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    stdout, stderr = [], []
+    threads = [threading.Thread(target=_drain, args=(process.stdout, None, stdout)),
+               threading.Thread(target=_drain, args=(process.stderr, None, stderr))]
+    if stdin:
+        threads.append(threading.Thread(target=_drain, args=(process.stdin, input_text, None)))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    rusage = None
+    if hasattr(os, 'wait4'):
+        # The child is reaped here rather than by Popen, which does not keep its rusage.
+        _, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+    else:
+        process.wait()
+    stdout, stderr = ''.join(stdout), ''.join(stderr)
+
+    usage = getattr(_current, 'usage', None)
+    if usage is not None and rusage is not None:
+        usage.peak_rss_mb = max(usage.peak_rss_mb, _peak_rss_mb(rusage))
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, cmd, stdout, stderr)
+    return stdout
+
+
+def note_cache_hit():
+    """Marks the current job as (partly) served from the build cache, so its cost is not recorded."""
+    usage = getattr(_current, 'usage', None)
+    if usage is not None:
+        usage.cache_hits += 1
+
+
+class JobUsage:
+    def __init__(self):
+        self.peak_rss_mb = 0
+        self.cache_hits = 0
+
+
+class JobCosts:
+    """Wall time and peak RSS of each job from previous builds, kept in build/job_costs.json.
+
+    Times are an exponential moving average. A peak RSS that grows is taken as
+    is and one that shrinks is only moved halfway, so the memory estimate errs
+    on the safe side. With path=None nothing is read or written.
+    """
+
+    def __init__(self, path=DEFAULT_COSTS_FILE):
+        self.path = path
+        self.jobs = {}
+        self.lock = threading.Lock()
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    data = json.load(f)
+                if data.get('version') == JOB_COSTS_VERSION:
+                    self.jobs = data.get('jobs', {})
+            except (OSError, ValueError):
+                pass # Estimates only; start over
+
+    def estimate(self, key):
+        """Returns (seconds, peak_rss_mb) for a job key such as 'document:byod_policy.md'."""
+        entry = self.jobs.get(key)
+        if entry:
+            return entry['seconds'], entry['peak_rss_mb']
+        return DEFAULT_COSTS.get(key.split(':', 1)[0], (1.0, 0))
+
+    def record(self, key, seconds, peak_rss_mb):
+        with self.lock:
+            entry = self.jobs.get(key)
+            if entry:
+                seconds = 0.5 * (entry['seconds'] + seconds)
+                if peak_rss_mb < entry['peak_rss_mb']:
+                    peak_rss_mb = 0.5 * (entry['peak_rss_mb'] + peak_rss_mb)
+            self.jobs[key] = {'seconds': round(seconds, 3), 'peak_rss_mb': round(peak_rss_mb, 1)}
+
+    def save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with self.lock:
+            with open(tmp_path, 'w') as f:
+                json.dump({'version': JOB_COSTS_VERSION, 'jobs': self.jobs}, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+def default_memory_budget_mb():
+    """Returns 75% of physical memory in MB, or None if it cannot be determined."""
+    try:
+        return int(os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') * 0.75 / (1024 * 1024))
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+class _Job:
+    def __init__(self, key, fn, args, seconds, rss_mb, dependencies):
+        self.key = key
+        self.fn = fn
+        self.args = args
+        self.seconds = seconds
+        self.rss_mb = rss_mb
+        self.dependencies = dependencies
+        self.future = Future()
+
+
+class Scheduler:
+    """Runs build jobs on a thread pool, longest first and within a memory budget.
+
+    Each job has a key; its expected wall time and peak RSS come from JobCosts
+    and are updated when it finishes, unless the build cache served part of it.
+    Of the jobs that are ready, the longest one whose memory fits next to the
+    running jobs is started; a job that does not fit waits, unless nothing is
+    running. A job submitted with after= starts once those futures are done,
+    so a tenant's combined manual does not wait for other tenants' documents.
+    """
+
+    def __init__(self, workers, memory_budget_mb=None, costs=None):
+        self.workers = workers
+        self.memory_budget_mb = memory_budget_mb
+        self.costs = costs if costs is not None else JobCosts(None)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        self.ready = []
+        self.running = 0
+        self.reserved_mb = 0
+        self.peak_reserved_mb = 0
+        self.job_count = 0
+        self.order = itertools.count() # Ties keep submission order
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.executor.shutdown(wait=True)
+
+    def submit(self, key, fn, *args, after=()):
+        """Schedules fn(*args) and returns a Future for its result."""
+        seconds, rss_mb = self.costs.estimate(key)
+        dependencies = [future for future in after if future is not None]
+        job = _Job(key, fn, args, seconds, rss_mb, len(dependencies))
+        with self.lock:
+            self.job_count += 1
+        if not dependencies:
+            self._make_ready(job)
+        for future in dependencies:
+            future.add_done_callback(lambda _, job=job: self._dependency_done(job))
+        return job.future
+
+    def _dependency_done(self, job):
+        with self.lock:
+            job.dependencies -= 1
+            ready = job.dependencies == 0
+        if ready:
+            self._make_ready(job)
+
+    def _make_ready(self, job):
+        with self.lock:
+            self.ready.append((-job.seconds, next(self.order), job))
+            self.ready.sort(key=lambda item: item[:2])
+        self._dispatch()
+
+    def _fits(self, job):
+        if self.running == 0 or self.memory_budget_mb is None:
+            return True
+        return self.reserved_mb + job.rss_mb <= self.memory_budget_mb
+
+    def _dispatch(self):
+        with self.lock:
+            while self.running < self.workers:
+                index = next((i for i, (_, _, job) in enumerate(self.ready) if self._fits(job)), None)
+                if index is None:
+                    break
+                job = self.ready.pop(index)[2]
+                self.running += 1
+                self.reserved_mb += job.rss_mb
+                self.peak_reserved_mb = max(self.peak_reserved_mb, self.reserved_mb)
+                self.executor.submit(self._run, job)
+
+    def _run(self, job):
+        _current.usage = usage = JobUsage()
+        start = time.perf_counter()
+        try:
+            result = job.fn(*job.args)
+            error = None
+        except BaseException as e:
+            error = e
+        finally:
+            _current.usage = None
+        if error is None and not usage.cache_hits:
+            self.costs.record(job.key, time.perf_counter() - start, usage.peak_rss_mb)
+
+        with self.lock:
+            self.running -= 1
+            self.reserved_mb -= job.rss_mb
+        self._dispatch()
+        if error is None:
+            job.future.set_result(result)
+        else:
+            job.future.set_exception(error)
+
+    def summary(self):
+        budget = f"{self.memory_budget_mb} MB" if self.memory_budget_mb is not None else "unlimited"
+        return (f"Scheduler: {self.job_count} job(s) longest first, memory budget {budget}, "
+                f"peak estimated use {self.peak_reserved_mb:.0f} MB.")
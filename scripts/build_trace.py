@@ -0,0 +1,94 @@
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+def progress(message, tenant='', document=None):
+    """Prints a progress line from a build worker, prefixed with its tenant and document.
+
+    The line is written in one call, so lines from parallel workers never run into each other.
+    """
+    prefix = f"[{tenant}] " if tenant else ""
+    if document:
+        prefix += f"{document}: "
+    sys.stdout.write(f"{prefix}{message}\n")
+
+
+class Tracer:
+    """Records timed spans for each build stage.
+
+    Spans are written as a Chrome trace (open it in chrome://tracing or
+    ui.perfetto.dev) and summarised per stage at the end of the run. When the
+    tracer is disabled, span() does no timing work.
+    """
+
+    def __init__(self, trace_file=None, trace_memory=False):
+        self.trace_file = trace_file
+        self.enabled = bool(trace_file)
+        self.trace_memory = self.enabled and trace_memory
+        self.events = []
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter_ns()
+        if self.trace_memory:
+            tracemalloc.start()
+
+    @contextmanager
+    def span(self, name, **fields):
+        """Times the enclosed block as one span.
+
+        Yields the span's args dict so the caller can add fields, such as output
+        sizes, that are only known once the work is done.
+        """
+        if not self.enabled:
+            yield fields
+            return
+        if self.trace_memory:
+            # The peak is process-wide, so with parallel workers it is an upper bound.
+            tracemalloc.reset_peak()
+        start = time.perf_counter_ns()
+        try:
+            yield fields
+        finally:
+            end = time.perf_counter_ns()
+            if self.trace_memory:
+                fields['tracemalloc_peak_kb'] = tracemalloc.get_traced_memory()[1] // 1024
+            event = {
+                'name': name,
+                'cat': 'build',
+                'ph': 'X',
+                'ts': (start - self._origin) / 1000,
+                'dur': (end - start) / 1000,
+                'pid': os.getpid(),
+                'tid': threading.get_ident(),
+                'args': fields,
+            }
+            with self._lock:
+                self.events.append(event)
+
+    def summary(self):
+        """Returns rows of (stage, count, total_ms, mean_ms, max_ms), slowest stage first."""
+        stages = {}
+        for event in self.events:
+            stages.setdefault(event['name'], []).append(event['dur'] / 1000)
+        rows = [
+            (name, len(durations), sum(durations), sum(durations) / len(durations), max(durations))
+            for name, durations in stages.items()
+        ]
+        return sorted(rows, key=lambda row: row[2], reverse=True)
+
+    def finish(self):
+        """Writes the trace file and prints the per-stage summary table."""
+        if not self.enabled:
+            return
+        os.makedirs(os.path.dirname(self.trace_file) or '.', exist_ok=True)
+        with open(self.trace_file, 'w') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
+
+        print(f"\n--- Build Timing ({self.trace_file}) ---")
+        print(f"{'Stage':<24} {'Count':>6} {'Total ms':>10} {'Mean ms':>10} {'Max ms':>10}")
+        for name, count, total, mean, longest in self.summary():
+            print(f"{name:<24} {count:>6} {total:>10.1f} {mean:>10.1f} {longest:>10.1f}")
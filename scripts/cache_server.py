@@ -0,0 +1,81 @@
+import argparse
+import os
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from remote_cache import REMOTE_CACHE_TOKEN_ENV, DirectoryRemoteCache
+
+
+class CacheRequestHandler(BaseHTTPRequestHandler):
+    """GET/HEAD/PUT /<entry> against a DirectoryRemoteCache."""
+
+    def _entry_name(self):
+        name = self.path.rsplit('/', 1)[-1]
+        # Entries are hex keys plus a suffix; anything else is not a cache entry.
+        if not name or name.startswith('.') or '\\' in name:
+            self.send_error(400)
+            return None
+        return name
+
+    def _check_token(self):
+        token = self.server.token
+        if token and self.headers.get('Authorization') != f"Bearer {token}":
+            self.send_error(401)
+            return False
+        return True
+
+    def do_GET(self, head=False):
+        name = self._entry_name()
+        if name is None or not self._check_token():
+            return
+        data = self.server.store._get(name)
+        if data is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(data)
+
+    def do_HEAD(self):
+        self.do_GET(head=True)
+
+    def do_PUT(self):
+        name = self._entry_name()
+        if name is None or not self._check_token():
+            return
+        data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.store._put(name, data)
+        self.send_response(201)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve a directory as a remote build cache, for trying --remote-cache locally or on a LAN.")
+    parser.add_argument('directory', help="Where to keep the cache entries.")
+    parser.add_argument('--host', default='127.0.0.1', help="Address to listen on (default: %(default)s).")
+    parser.add_argument('--port', type=int, default=8765, help="Port to listen on (default: %(default)s).")
+    parser.add_argument('--token', default=os.environ.get(REMOTE_CACHE_TOKEN_ENV),
+                        help=f"Require this bearer token (default: ${REMOTE_CACHE_TOKEN_ENV}, if set).")
+    parser.add_argument('--verbose', action='store_true', help="Log every request.")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), CacheRequestHandler)
+    server.store = DirectoryRemoteCache(args.directory)
+    server.token = args.token
+    server.verbose = args.verbose
+    print(f"Serving the cache in {args.directory} at http://{args.host}:{server.server_port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+import hashlib
+import json
+import os
+from jinja2 import meta, nodes
+
+DEFAULT_GRAPH_FILE = os.path.join('build', 'dependency_graph.json')
+GRAPH_VERSION = 1
+
+# Keys read by process_policies.py itself rather than by the templates. Every
+# document depends on them because they change how it is converted.
+BUILD_CONFIG_KEYS = [
+    'md_show_revision_history', 'pdf_show_revision_history', 'combined_pdf_show_revision_history',
+    'release_commit_prefix', 'global_release_history_style',
+    'pdf_main_font', 'pdf_header_font', 'pdf_code_font', 'pdf_odt_reference_doc',
+]
+
+
+def _attribute_chain(node):
+    """Returns (root_name, [attr, ...]) for a chain like a.b['c'].d, or None."""
+    parts = []
+    while True:
+        if isinstance(node, nodes.Getattr):
+            parts.append(node.attr)
+            node = node.node
+        elif isinstance(node, nodes.Getitem) and isinstance(node.arg, nodes.Const) \
+                and isinstance(node.arg.value, (str, int)):
+            parts.append(str(node.arg.value))
+            node = node.node
+        else:
+            break
+    if isinstance(node, nodes.Name) and node.ctx == 'load':
+        return node.name, list(reversed(parts))
+    return None
+
+
+def find_config_paths(ast):
+    """Returns {dotted_path: first_line} for every config path a template reads.
+
+    Attribute and constant-subscript chains rooted at a context variable are
+    reported in full, e.g. 'byod.allowed_devices.phones'. Chains rooted at loop
+    variables are skipped; the loop's iterable (e.g. 'vendors') is reported instead.
+    A method call such as 'approved_os.servers.items()' reports the object it is
+    called on.
+    """
+    context_names = meta.find_undeclared_variables(ast)
+    found = {}
+
+    def visit(node):
+        if isinstance(node, nodes.Call) and isinstance(node.node, nodes.Getattr):
+            visit(node.node.node)
+            for child in node.iter_child_nodes(exclude=('node',)):
+                visit(child)
+            return
+        if isinstance(node, (nodes.Getattr, nodes.Getitem, nodes.Name)):
+            chain = _attribute_chain(node)
+            if chain:
+                root, parts = chain
+                if root in context_names:
+                    found.setdefault('.'.join([root] + parts), node.lineno)
+                return
+        for child in node.iter_child_nodes():
+            visit(child)
+
+    visit(ast)
+    return found
+
+
+def find_guarded_paths(ast):
+    """Returns the dotted paths a template treats as optional.
+
+    These are the paths passed through the 'default' filter or tested with
+    'is defined' / 'is undefined'.
+    """
+    guarded = set()
+    for node in ast.find_all((nodes.Filter, nodes.Test)):
+        if node.name not in ('default', 'd', 'defined', 'undefined') or node.node is None:
+            continue
+        chain = _attribute_chain(node.node)
+        if chain:
+            root, parts = chain
+            guarded.add('.'.join([root] + parts))
+    return guarded
+
+
+def resolve_path(config, path):
+    """Walks a dotted path through the config.
+
+    Returns (resolved_parts, value) where resolved_parts is the longest prefix
+    that exists. Paths that run past the data (e.g. a '.items' method call)
+    resolve to their deepest existing parent.
+    """
+    node = config
+    resolved = []
+    for part in path.split('.'):
+        if isinstance(node, dict) and part in node:
+            node = node[part]
+        elif isinstance(node, list) and part.isdigit() and int(part) < len(node):
+            node = node[int(part)]
+        else:
+            break
+        resolved.append(part)
+    return resolved, node
+
+
+def fingerprint(value):
+    """Returns a stable hash of a config value."""
+    encoded = json.dumps(value, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def config_fingerprint(config, path):
+    """Hashes the config value a dotted path depends on.
+
+    A path whose root key is missing hashes as undefined, so adding the key
+    later is still detected as a change.
+    """
+    resolved, value = resolve_path(config, path)
+    if not resolved:
+        return fingerprint(['<undefined>'])
+    return fingerprint(['.'.join(resolved), value])
+
+
+class ConfigIndex:
+    """An immutable index of every dotted path in a config.
+
+    Built once with an explicit stack. Lists are not descended into, so a
+    config with thousands of vendors costs one entry for 'vendors'. Lookups
+    are set membership tests.
+    """
+
+    def __init__(self, config):
+        paths = set()
+        leaves = set()
+        stack = [((), config)] if isinstance(config, dict) else []
+        while stack:
+            prefix, node = stack.pop()
+            for key, value in node.items():
+                path = prefix + (str(key),)
+                dotted = '.'.join(path)
+                paths.add(dotted)
+                if isinstance(value, dict):
+                    stack.append((path, value))
+                else:
+                    leaves.add(dotted)
+        self.paths = frozenset(paths)
+        self.leaves = frozenset(leaves)
+
+    def __contains__(self, path):
+        return path in self.paths
+
+    def __iter__(self):
+        return iter(sorted(self.paths))
+
+    def __len__(self):
+        return len(self.paths)
+
+    def missing_prefix(self, path):
+        """Returns the first part of a dotted path that is not in the config, or None.
+
+        Anything below a list or scalar (e.g. 'vendors.0.name') is not checked.
+        """
+        parts = path.split('.')
+        for i in range(1, len(parts) + 1):
+            prefix = '.'.join(parts[:i])
+            if prefix not in self.paths:
+                return prefix
+            if prefix in self.leaves:
+                return None
+        return None
+
+
+class DependencyGraph:
+    """Records which inputs every document was last built from.
+
+    Each document entry holds the hashes of its template, the order entry that
+    names it, its history table, and every config path it reads. changes()
+    compares those against the current inputs and explains why a document is
+    rebuilt. With path=None the graph lives in memory only.
+    """
+
+    def __init__(self, path=DEFAULT_GRAPH_FILE):
+        self.path = path
+        self.documents = {}
+        if not path:
+            return
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+            if data.get('version') == GRAPH_VERSION:
+                self.documents = data.get('documents', {})
+        except (OSError, ValueError):
+            pass
+
+    def cached_paths(self, doc_id, template_hash):
+        """Returns the config paths recorded for an unchanged template, or None."""
+        entry = self.documents.get(doc_id)
+        if entry and entry.get('template') == template_hash:
+            return list(entry.get('inputs', {}))
+        return None
+
+    @staticmethod
+    def describe(config, template_hash, paths, order_entry, history_table):
+        """Builds the entry describing a document's current inputs."""
+        return {
+            'template': template_hash,
+            'order_entry': fingerprint(order_entry),
+            'history': fingerprint(history_table),
+            'inputs': {path: config_fingerprint(config, path) for path in sorted(set(paths) | set(BUILD_CONFIG_KEYS))},
+        }
+
+    def changes(self, doc_id, current):
+        """Returns a list of reasons the document must be rebuilt (empty if up to date)."""
+        previous = self.documents.get(doc_id)
+        if previous is None:
+            return ['not built before']
+        reasons = []
+        if previous.get('template') != current['template']:
+            reasons.append('template changed')
+        if previous.get('order_entry') != current['order_entry']:
+            reasons.append('output name or title changed')
+        if previous.get('history') != current['history']:
+            reasons.append('version history changed')
+        changed_paths = [
+            path for path, value in current['inputs'].items()
+            if previous.get('inputs', {}).get(path) != value
+        ]
+        if changed_paths and 'template changed' not in reasons:
+            reasons.append(f"config changed: {', '.join(changed_paths)}")
+        return reasons
+
+    def update(self, doc_id, current):
+        self.documents[doc_id] = current
+
+    def save(self, keep=None):
+        """Writes the graph, dropping documents that are no longer in `keep`."""
+        if keep is not None:
+            self.documents = {k: v for k, v in self.documents.items() if k in keep}
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': GRAPH_VERSION, 'documents': self.documents}, f, indent=2)
+        os.replace(tmp_path, self.path)
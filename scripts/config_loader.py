@@ -0,0 +1,103 @@
+import hashlib
+import json
+import os
+import tempfile
+from collections import OrderedDict
+import yaml
+
+DEFAULT_CONFIG_CACHE_DIR = os.path.join('build', 'config_cache')
+CONFIG_CACHE_VERSION = 2
+CONFIG_CACHE_MAX_ENTRIES = 64
+
+# libyaml's C parser is several times faster than the pure-Python one. PyYAML
+# builds without libyaml fall back to the Python loader.
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+class OrderedSafeLoader(SafeLoader):
+    """A SafeLoader that builds OrderedDicts, for the config UI's ordered_dump."""
+
+
+def _construct_ordered_mapping(loader, node):
+    loader.flatten_mapping(node)
+    return OrderedDict(loader.construct_pairs(node))
+
+
+OrderedSafeLoader.add_constructor(yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG, _construct_ordered_mapping)
+
+
+def _cache_key(data, ordered):
+    digest = hashlib.sha256()
+    digest.update(f"{CONFIG_CACHE_VERSION}:{SafeLoader.__name__}:{ordered}:".encode('ascii'))
+    digest.update(data)
+    return digest.hexdigest()
+
+
+def _prune(cache_dir):
+    """Keeps only the most recently used CONFIG_CACHE_MAX_ENTRIES entries."""
+    try:
+        entries = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir) if name.endswith('.json')]
+        if len(entries) <= CONFIG_CACHE_MAX_ENTRIES:
+            return
+        entries.sort(key=os.path.getmtime)
+        for path in entries[:-CONFIG_CACHE_MAX_ENTRIES]:
+            os.remove(path)
+    except OSError:
+        pass
+
+
+def parse_yaml(data, ordered=False, cache_dir=DEFAULT_CONFIG_CACHE_DIR):
+    """Parses YAML bytes, reusing the parsed result cached for identical content.
+
+    The cache holds JSON files named by a hash of the content, so every tool
+    parses a given version of a file once. An entry is only used if the hash
+    stored in it matches, and values JSON cannot represent exactly (dates,
+    non-string keys) are not cached. With cache_dir=None nothing is cached.
+    Raises yaml.YAMLError on invalid YAML, as yaml.safe_load does.
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    loader = OrderedSafeLoader if ordered else SafeLoader
+    if not cache_dir:
+        return yaml.load(data, Loader=loader)
+
+    key = _cache_key(data, ordered)
+    entry = os.path.join(cache_dir, key + '.json')
+    object_pairs_hook = OrderedDict if ordered else None
+    try:
+        with open(entry, 'r') as f:
+            cached = json.load(f, object_pairs_hook=object_pairs_hook)
+        if cached.get('key') == key:
+            os.utime(entry)
+            return cached['value']
+    except (OSError, ValueError, AttributeError, KeyError):
+        pass
+
+    value = yaml.load(data, Loader=loader)
+    try:
+        text = json.dumps({'key': key, 'value': value})
+        if json.loads(text, object_pairs_hook=object_pairs_hook)['value'] != value:
+            return value # e.g. integer keys, which JSON would turn into strings
+    except (TypeError, ValueError):
+        return value # e.g. dates
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    except OSError:
+        return value
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        os.replace(tmp_path, entry)
+        _prune(cache_dir)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return value
+
+
+def load_yaml(path, ordered=False, cache_dir=DEFAULT_CONFIG_CACHE_DIR):
+    """Reads and parses a YAML file. See parse_yaml()."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    return parse_yaml(data, ordered=ordered, cache_dir=cache_dir)
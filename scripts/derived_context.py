@@ -0,0 +1,72 @@
+"""Indexes derived from the config once per build and added to the render context.
+
+Templates can use them instead of scanning the whole vendor list, e.g.
+
+    {% for vendor in vendors_by_service['Security'] %}
+
+instead of {% for vendor in vendors if 'Security' in vendor.services %}.
+ConfigValidator checks the templates against the same context, so a template
+that reads a derived key is not reported as using an undefined variable.
+"""
+
+# The services offered by the vendor editor in conf/ui_schema.yaml. Each has an
+# entry in vendors_by_service even when no vendor provides it, so templates can
+# loop over it without a guard.
+VENDOR_SERVICES = ['Data Storage', 'Hosting', 'Platform', 'Monitoring', 'Security', 'Data Backup', 'Disaster Recovery']
+
+
+def _mapping(config, key):
+    value = config.get(key)
+    return value if isinstance(value, dict) else {}
+
+
+def vendor_list(config):
+    """Returns the config's vendors, skipping malformed entries."""
+    vendors = config.get('vendors')
+    if not isinstance(vendors, list):
+        return []
+    return [vendor for vendor in vendors if isinstance(vendor, dict)]
+
+
+def derive_ephi_access(config):
+    """Returns True if any enabled service type has phi_access; the canonical ephi_access flag should match."""
+    return any(
+        isinstance(details, dict) and details.get('enabled') and details.get('phi_access')
+        for details in _mapping(config, 'service_types').values()
+    )
+
+
+def derive_context(config):
+    """Returns a new dict with the config and the derived indexes.
+
+    - vendors_by_service: {service: [vendor, ...]} in config order
+    - vendors_with_baa: the vendors with baa_signed
+    - enabled_service_types: {name: details} of the enabled service_types
+    - supported_frameworks: {name: details} of the supported compliance_frameworks
+    - ephi_access: derived from service_types, unless the config sets it
+
+    A config key with the same name as a derived one takes precedence.
+    """
+    vendors = vendor_list(config)
+    vendors_by_service = {service: [] for service in VENDOR_SERVICES}
+    for vendor in vendors:
+        services = vendor.get('services')
+        if not isinstance(services, list):
+            continue
+        for service in dict.fromkeys(s for s in services if isinstance(s, str)):
+            vendors_by_service.setdefault(service, []).append(vendor)
+
+    derived = {
+        'vendors_by_service': vendors_by_service,
+        'vendors_with_baa': [vendor for vendor in vendors if vendor.get('baa_signed')],
+        'enabled_service_types': {
+            name: details for name, details in _mapping(config, 'service_types').items()
+            if isinstance(details, dict) and details.get('enabled')
+        },
+        'supported_frameworks': {
+            name: details for name, details in _mapping(config, 'compliance_frameworks').items()
+            if isinstance(details, dict) and details.get('supported')
+        },
+        'ephi_access': derive_ephi_access(config),
+    }
+    return {**derived, **config}
@@ -1,114 +1,73 @@
-import os
-import subprocess
-import json
-from datetime import datetime
-import yaml # Requires PyYAML
+import argparse
+import atexit
+from config_loader import load_yaml
+from build_trace import Tracer
+from git_history import (DEFAULT_HISTORY_FILE, DEFAULT_USERMAP_FILE, HistoryError, current_commit_from_env,
+                         export_history, load_usermap, write_history)
+from history_store import DEFAULT_RELEASE_PREFIX
 
-print("Starting Git history export...")
+CONFIG_FILE = 'conf/config.yaml'
+ORDER_FILE = 'conf/policy_order.yaml'
+POLICY_DIR = 'policies'
 
-# Config paths
-order_file = 'conf/policy_order.yaml'
-usermap_file = 'conf/usermap.json'
-policy_dir = 'policies'
-output_dir = 'build'
-output_file = os.path.join(output_dir, 'git_history.json')
 
-# Load usermap
-try:
-    with open(usermap_file, 'r') as f:
-        usermap = json.load(f)
-except Exception as e:
-    print(f"Error loading usermap {usermap_file}: {e}")
-    usermap = {} # Continue with empty map if not found
+def main():
+    parser = argparse.ArgumentParser(description="Export the git history of every policy file to build/git_history.sqlite.")
+    parser.add_argument('--single-pass', action='store_true',
+                        help="Read the whole history with one 'git log --name-status -M' instead of one 'git log --follow' per policy.")
+    parser.add_argument('--verify', action='store_true',
+                        help="Run both the per-file and the single-pass export and fail if they differ.")
+    parser.add_argument('--output', default=DEFAULT_HISTORY_FILE,
+                        help="History file to write; a name ending in .json writes the old JSON format (default: %(default)s).")
+    parser.add_argument('--trace', metavar='FILE',
+                        help="Write a Chrome/Perfetto trace of the export to FILE and print a timing summary.")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="With --trace, also record tracemalloc peaks for each span.")
+    args = parser.parse_args()
 
-# Ensure build directory exists
-os.makedirs(output_dir, exist_ok=True)
+    tracer = Tracer(args.trace, trace_memory=args.trace_memory)
+    atexit.register(tracer.finish)
 
-# --- 1. Get the Current Build Commit Info ---
-# We get this from the environment variables set by the GitHub Action
-print("Getting current build commit info...")
-try:
-    actor = os.environ['CURRENT_COMMIT_ACTOR']
-    current_commit = {
-        'hash': os.environ['CURRENT_COMMIT_SHA'],
-        'author_name': usermap.get(actor, actor), # Map the name
-        'date': datetime.now().strftime('%Y-%m-%d'),
-        'subject': os.environ.get('CURRENT_COMMIT_MSG', 'Build triggered by workflow_dispatch')
-    }
-    # Get the global release flag
-    is_global_release = os.environ.get('IS_GLOBAL_RELEASE') == 'true'
-    
-except KeyError:
-    print("Could not get current commit info from env variables. Aborting.")
-    exit(1)
+    print("Starting Git history export...")
+    usermap = load_usermap(DEFAULT_USERMAP_FILE)
 
-
-# --- 2. Get File-Specific History ---
-print("Getting file-specific history...")
-file_history = {}
-
-# Load the policy order config
-try:
-    with open(order_file, 'r') as f:
-        policy_order_config = yaml.safe_load(f)
-    POLICY_FILES_LIST = policy_order_config.get('policy_files', [])
-except Exception as e:
-    print(f"ERROR: Could not load or parse {order_file}: {e}")
-    exit(1)
-
-for policy_item in POLICY_FILES_LIST:
+    # --- 1. Get the Current Build Commit Info ---
+    # We get this from the environment variables set by the GitHub Action
+    print("Getting current build commit info...")
     try:
-        policy_filename = policy_item['source']
-    except (TypeError, KeyError):
-        continue # Skip malformed entries
+        current_commit, is_global_release = current_commit_from_env(usermap)
+    except HistoryError as e:
+        print(f"{e} Aborting.")
+        exit(1)
 
-    file_path = os.path.join(policy_dir, policy_filename)
-    
-    # Git command to get log *for this file only*
-    cmd = [
-        'git', 'log',
-        '--pretty=format:%H|%an|%ad|%s',
-        '--date=short',
-        '--follow',
-        '--', file_path
-    ]
-    
+    # --- 2. Get File-Specific History ---
+    print("Getting file-specific history...")
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+        with tracer.span('yaml_load', file=ORDER_FILE):
+            policy_order_config = load_yaml(ORDER_FILE)
+        policy_files = policy_order_config.get('policy_files', [])
     except Exception as e:
-        print(f"  Warning: Could not get git history for {file_path}. Maybe it's a new file? Error: {e}")
-        file_history[policy_filename] = []
-        continue
-
-    file_commits = []
-    for line in result.stdout.strip().split('\n'):
-        if not line:
-            continue
-        
-        try:
-            hash_val, author_name, date, subject = line.split('|', 3)
-            mapped_name = usermap.get(author_name, author_name)
-            
-            file_commits.append({
-                'hash': hash_val,
-                'author_name': mapped_name,
-                'date': date,
-                'subject': subject
-            })
-        except ValueError:
-            print(f"  Skipping malformed log line: {line}")
-    
-    file_history[policy_filename] = file_commits
+        print(f"ERROR: Could not load or parse {ORDER_FILE}: {e}")
+        exit(1)
 
-# --- 3. Write all data to the JSON file ---
-final_history_data = {
-    "current_build_commit": current_commit,
-    "is_global_release": is_global_release,
-    "file_history": file_history
-}
+    mode = 'verify' if args.verify else 'single-pass' if args.single_pass else 'per-file'
+    try:
+        history_data = export_history(policy_files, usermap, current_commit, is_global_release,
+                                      mode=mode, policy_dir=POLICY_DIR, tracer=tracer)
+    except HistoryError as e:
+        print(f"ERROR: {e}")
+        exit(1)
 
-with open(output_file, 'w') as f:
-    json.dump(final_history_data, f, indent=2)
+    # --- 3. Write all data to the history store ---
+    # Release commits are flagged once here, using the config's prefix.
+    try:
+        release_prefix = (load_yaml(CONFIG_FILE) or {}).get('release_commit_prefix', DEFAULT_RELEASE_PREFIX)
+    except Exception as e:
+        print(f"Could not read release_commit_prefix from {CONFIG_FILE}, using '{DEFAULT_RELEASE_PREFIX}': {e}")
+        release_prefix = DEFAULT_RELEASE_PREFIX
+    write_history(history_data, args.output, release_prefix, tracer=tracer)
+    print(f"Git history successfully exported to {args.output}")
 
-print(f"Git history successfully exported to {output_file}")
 
+if __name__ == "__main__":
+    main()
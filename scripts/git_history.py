@@ -0,0 +1,225 @@
+import json
+import os
+import subprocess
+from datetime import datetime
+from build_trace import Tracer
+from history_store import DEFAULT_RELEASE_PREFIX, HistoryStore
+
+DEFAULT_HISTORY_FILE = os.path.join('build', 'git_history.sqlite')
+DEFAULT_USERMAP_FILE = 'conf/usermap.json'
+
+LOG_FORMAT = '%H|%an|%ad|%s'
+# Marks the start of each commit in the single-pass log, so it can't be
+# confused with the name-status lines that follow it.
+COMMIT_MARKER = '\x1e'
+
+
+class HistoryError(Exception):
+    """Raised when the history cannot be exported."""
+
+
+def load_usermap(usermap_file=DEFAULT_USERMAP_FILE):
+    """Returns the git author name -> display name map, or {} if it can't be read."""
+    try:
+        with open(usermap_file, 'r') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Error loading usermap {usermap_file}: {e}")
+        return {} # Continue with empty map if not found
+
+
+def current_commit_from_env(usermap, environ=os.environ):
+    """Returns (current_commit, is_global_release) from the variables set by the GitHub Action."""
+    try:
+        actor = environ['CURRENT_COMMIT_ACTOR']
+        current_commit = {
+            'hash': environ['CURRENT_COMMIT_SHA'],
+            'author_name': usermap.get(actor, actor), # Map the name
+            'date': datetime.now().strftime('%Y-%m-%d'),
+            'subject': environ.get('CURRENT_COMMIT_MSG', 'Build triggered by workflow_dispatch')
+        }
+    except KeyError:
+        raise HistoryError("Could not get current commit info from env variables.")
+    return current_commit, environ.get('IS_GLOBAL_RELEASE') == 'true'
+
+
+def policy_sources(policy_files):
+    """Returns the 'source' of every well-formed policy_order.yaml entry."""
+    sources = []
+    for policy_item in policy_files:
+        try:
+            sources.append(policy_item['source'])
+        except (TypeError, KeyError):
+            continue # Skip malformed entries
+    return sources
+
+
+def parse_log_line(line, usermap):
+    """Turns a '%H|%an|%ad|%s' log line into a commit dict, or None if malformed."""
+    try:
+        hash_val, author_name, date, subject = line.split('|', 3)
+    except ValueError:
+        print(f"  Skipping malformed log line: {line}")
+        return None
+    mapped_name = usermap.get(author_name, author_name)
+    return {
+        'hash': hash_val,
+        'author_name': mapped_name,
+        'date': date,
+        'subject': subject
+    }
+
+
+def get_history_per_file(sources, usermap, policy_dir='policies', tracer=None):
+    """Runs one 'git log --follow' per policy file."""
+    tracer = tracer or Tracer()
+    history = {}
+    for policy_filename in sources:
+        file_path = os.path.join(policy_dir, policy_filename)
+
+        # Git command to get log *for this file only*
+        cmd = [
+            'git', 'log',
+            f'--pretty=format:{LOG_FORMAT}',
+            '--date=short',
+            '--follow',
+            '--', file_path
+        ]
+
+        try:
+            with tracer.span('git_log', policy=policy_filename, mode='per-file') as span:
+                result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+                span['bytes'] = len(result.stdout)
+        except Exception as e:
+            print(f"  Warning: Could not get git history for {file_path}. Maybe it's a new file? Error: {e}")
+            history[policy_filename] = []
+            continue
+
+        file_commits = []
+        for line in result.stdout.strip().split('\n'):
+            if not line:
+                continue
+            commit = parse_log_line(line, usermap)
+            if commit:
+                file_commits.append(commit)
+
+        history[policy_filename] = file_commits
+    return history
+
+
+def get_history_single_pass(sources, usermap, policy_dir='policies', tracer=None):
+    """Assigns commits to policy files from a single streamed 'git log --name-status -M'.
+
+    The log is read newest first. Each policy is tracked under the path it had at
+    the commit being read; when a rename onto that path is seen, tracking moves to
+    the old name, which is what 'git log --follow' does for a single file.
+    """
+    tracer = tracer or Tracer()
+    history = {policy_filename: [] for policy_filename in sources}
+    tracked = {os.path.join(policy_dir, policy_filename): policy_filename for policy_filename in sources}
+
+    cmd = [
+        'git', '-c', 'core.quotePath=false', 'log',
+        f'--pretty=format:{COMMIT_MARKER}{LOG_FORMAT}',
+        '--date=short',
+        '--name-status',
+        '-M',
+    ]
+
+    try:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    except OSError as e:
+        print(f"  Warning: Could not run git log: {e}")
+        return history
+
+    commit = None
+    renames = {}
+    touched = []
+
+    def finish_commit():
+        # Renames are applied after the whole commit is read, so a commit that
+        # renames a -> b and c -> a still credits both policies correctly.
+        for policy_filename in touched:
+            history[policy_filename].append(commit)
+        for new_path, old_path in renames.items():
+            policy_filename = tracked.pop(new_path, None)
+            if policy_filename is not None:
+                tracked[old_path] = policy_filename
+
+    with tracer.span('git_log', mode='single-pass'):
+        for line in proc.stdout:
+            line = line.rstrip('\n')
+            if line.startswith(COMMIT_MARKER):
+                if commit:
+                    finish_commit()
+                commit = parse_log_line(line[len(COMMIT_MARKER):], usermap)
+                renames = {}
+                touched = []
+                continue
+            if not line or commit is None:
+                continue
+
+            parts = line.split('\t')
+            status, paths = parts[0], parts[1:]
+            # For renames and copies the new path is last; for everything else there is one path.
+            path = paths[-1] if paths else None
+            policy_filename = tracked.get(path)
+            if policy_filename is None or policy_filename in touched:
+                continue
+            touched.append(policy_filename)
+            if status.startswith('R') and len(paths) == 2:
+                renames[path] = paths[0]
+
+        if commit:
+            finish_commit()
+
+    stderr = proc.stderr.read()
+    if proc.wait() != 0:
+        print(f"  Warning: git log exited with status {proc.returncode}: {stderr.strip()}")
+        return {policy_filename: [] for policy_filename in sources}
+    return history
+
+
+def export_history(policy_files, usermap, current_commit, is_global_release, mode='per-file',
+                   policy_dir='policies', tracer=None):
+    """Returns the history data that write_history() stores for process_policies.py.
+
+    mode is 'per-file', 'single-pass', or 'verify' (run both and raise
+    HistoryError if they differ).
+    """
+    sources = policy_sources(policy_files)
+    if mode == 'verify':
+        per_file_history = get_history_per_file(sources, usermap, policy_dir, tracer)
+        single_pass_history = get_history_single_pass(sources, usermap, policy_dir, tracer)
+        mismatched = [p for p in sources if per_file_history.get(p) != single_pass_history.get(p)]
+        if mismatched:
+            raise HistoryError("The per-file and single-pass histories differ for:\n" +
+                               '\n'.join(f"  - {policy_filename}" for policy_filename in mismatched))
+        print("Per-file and single-pass histories are identical.")
+        file_history = per_file_history
+    elif mode == 'single-pass':
+        file_history = get_history_single_pass(sources, usermap, policy_dir, tracer)
+    else:
+        file_history = get_history_per_file(sources, usermap, policy_dir, tracer)
+
+    return {
+        "current_build_commit": current_commit,
+        "is_global_release": is_global_release,
+        "file_history": file_history
+    }
+
+
+def write_history(history_data, output_file=DEFAULT_HISTORY_FILE, release_prefix=DEFAULT_RELEASE_PREFIX, tracer=None):
+    """Writes the history to a HistoryStore, or to indented JSON if output_file ends in .json.
+
+    release_prefix is the config's release_commit_prefix; matching commits are
+    flagged in the store so the build does not filter every commit again.
+    """
+    tracer = tracer or Tracer()
+    os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+    with tracer.span('history_write', file=output_file):
+        if output_file.endswith('.json'):
+            with open(output_file, 'w') as f:
+                json.dump(history_data, f, indent=2)
+        else:
+            HistoryStore.write(history_data, output_file, release_prefix)
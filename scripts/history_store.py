@@ -0,0 +1,124 @@
+import json
+import os
+import sqlite3
+import threading
+
+HISTORY_STORE_VERSION = 1
+DEFAULT_RELEASE_PREFIX = 'RELEASE:'
+
+SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE commits (
+    id INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL UNIQUE,
+    date TEXT NOT NULL,
+    author_name TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    is_release INTEGER NOT NULL
+);
+-- One row per (policy, commit), in git log order. The primary key makes a
+-- document's history a single range scan.
+CREATE TABLE file_commits (
+    policy TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    commit_id INTEGER NOT NULL REFERENCES commits (id),
+    PRIMARY KEY (policy, position)
+) WITHOUT ROWID;
+"""
+
+COMMIT_COLUMNS = ('hash', 'author_name', 'date', 'subject')
+
+
+class HistoryStore:
+    """The exported git history, stored in SQLite and queried one document at a time.
+
+    Commits are stored once however many policies they touch. Whether a commit
+    is a release (its subject starts with the release prefix) is decided when
+    the store is written, so the build only reads the rows it will show.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        # Planning and the build pipeline may query from different threads.
+        self.lock = threading.Lock()
+        meta = dict(connection.execute("SELECT key, value FROM meta"))
+        if int(meta.get('version', 0)) != HISTORY_STORE_VERSION:
+            raise ValueError(f"unsupported history store version {meta.get('version')}")
+        self.current_build_commit = json.loads(meta['current_build_commit'])
+        self.is_global_release = meta['is_global_release'] == '1'
+        self.release_prefix = meta['release_prefix']
+
+    @classmethod
+    def open(cls, path):
+        """Opens a store written by write(). Raises if it is missing or unreadable."""
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No such file: '{path}'")
+        return cls(sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False))
+
+    @classmethod
+    def from_data(cls, history_data, release_prefix=DEFAULT_RELEASE_PREFIX):
+        """Builds an in-memory store from history data as returned by git_history.export_history()."""
+        connection = sqlite3.connect(':memory:', check_same_thread=False)
+        fill(connection, history_data, release_prefix)
+        return cls(connection)
+
+    @staticmethod
+    def write(history_data, path, release_prefix=DEFAULT_RELEASE_PREFIX):
+        """Writes history data to a store file, replacing any previous one atomically."""
+        tmp_path = path + '.tmp'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        connection = sqlite3.connect(tmp_path)
+        try:
+            fill(connection, history_data, release_prefix)
+        finally:
+            connection.close()
+        os.replace(tmp_path, path)
+
+    def release_commits(self, policy_filename, release_prefix, include_hash=None):
+        """Returns the policy's release commits in git log order, plus include_hash if the policy has it."""
+        if release_prefix == self.release_prefix:
+            condition = "c.is_release = 1"
+            params = [policy_filename, include_hash or '']
+        else:
+            # Another tenant's prefix: filter on the subject instead of the precomputed flag.
+            condition = "substr(c.subject, 1, ?) = ?"
+            params = [policy_filename, len(release_prefix), release_prefix, include_hash or '']
+        return self._query(f"f.policy = ? AND ({condition} OR c.hash = ?)", params)
+
+    def commit(self, policy_filename, commit_hash):
+        """Returns the policy's commit with the given hash, or None."""
+        rows = self._query("f.policy = ? AND c.hash = ?", [policy_filename, commit_hash])
+        return rows[0] if rows else None
+
+    def _query(self, where, params):
+        sql = (f"SELECT {', '.join('c.' + column for column in COMMIT_COLUMNS)} FROM file_commits f "
+               f"JOIN commits c ON c.id = f.commit_id WHERE {where} ORDER BY f.position")
+        with self.lock:
+            rows = self.connection.execute(sql, params).fetchall()
+        return [dict(zip(COMMIT_COLUMNS, row)) for row in rows]
+
+
+def fill(connection, history_data, release_prefix):
+    connection.executescript(SCHEMA)
+    commit_ids = {}
+    file_rows = []
+    for policy_filename, commits in history_data.get('file_history', {}).items():
+        for position, commit in enumerate(commits):
+            commit_id = commit_ids.get(commit['hash'])
+            if commit_id is None:
+                commit_id = connection.execute(
+                    "INSERT INTO commits (hash, date, author_name, subject, is_release) VALUES (?, ?, ?, ?, ?)",
+                    (commit['hash'], commit['date'], commit['author_name'], commit['subject'],
+                     int(commit['subject'].startswith(release_prefix))),
+                ).lastrowid
+                commit_ids[commit['hash']] = commit_id
+            file_rows.append((policy_filename, position, commit_id))
+    connection.executemany("INSERT INTO file_commits (policy, position, commit_id) VALUES (?, ?, ?)", file_rows)
+    connection.executemany("INSERT INTO meta (key, value) VALUES (?, ?)", [
+        ('version', str(HISTORY_STORE_VERSION)),
+        ('current_build_commit', json.dumps(history_data.get('current_build_commit'))),
+        ('is_global_release', '1' if history_data.get('is_global_release') else '0'),
+        ('release_prefix', release_prefix),
+    ])
+    connection.commit()
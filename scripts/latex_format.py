@@ -0,0 +1,142 @@
+"""A precompiled xelatex format for the preamble every individual PDF shares.
+
+Loading the LaTeX packages pandoc's template needs (fontspec through
+unicode-math, amsmath, xcolor, the table packages, ...) is a large part of
+every xelatex start. Those packages are the same for every policy of a tenant,
+so they are dumped into a format file once with mylatexformat, and each
+per-policy run starts from it:
+
+- policy.latex is pandoc's default LaTeX template with the packages loaded
+  right after \\documentclass, followed by mylatexformat's \\endofdump marker.
+- preamble.tex is that template rendered for an empty document with the
+  tenant's PDF options; everything up to the marker is dumped to policy.fmt.
+- A probe document is converted with the format before it is used.
+
+The fonts themselves cannot be dumped by XeTeX, so they are still resolved per
+run, after the marker. Everything before the marker depends only on the
+template and the command line options, never on a document's content, which
+is why the documents' metadata has to come from the command line.
+
+The format is kept in build/latex_format/<key>/, keyed on the pandoc and
+xelatex versions, the template and the PDF options (fonts included). If any
+step fails, the build falls back to the normal template and full preamble.
+"""
+import os
+import re
+import shutil
+import subprocess
+from build_cache import hash_parts
+
+FORMAT_DIR = os.path.join('build', 'latex_format')
+FORMAT_VERSION = '1'
+KEEP_FORMATS = 4 # Format directories kept, most recently used first
+
+DUMP_MARKER = '\\csname endofdump\\endcsname'
+
+# Loaded in the order pandoc's template loads them, so its own \usepackage lines
+# become no-ops. hyperref is left out: it has to come after the other packages.
+PRELOAD = r"""\usepackage{amsmath,amssymb}
+\usepackage{iftex}
+\ifPDFTeX\else
+  \usepackage{unicode-math}
+\fi
+\usepackage{xcolor}
+\usepackage{longtable,booktabs,array}
+\usepackage{calc}
+\usepackage{graphicx}
+"""
+
+DOCUMENTCLASS_LINE = re.compile(r'\{\$documentclass\$\}[^\n]*\n')
+
+PROBE_MARKDOWN = """# Probe
+
+Text with *emphasis*, `code` and a [link](https://example.com).
+
+| Column | Value |
+| :--- | :--- |
+| a | 1 |
+
+- item
+"""
+
+
+def add_dump_point(template):
+    """Returns pandoc's LaTeX template with PRELOAD and the dump marker after \\documentclass, or None."""
+    match = DOCUMENTCLASS_LINE.search(template)
+    if not match:
+        return None
+    return template[:match.end()] + PRELOAD + DUMP_MARKER + '\n' + template[match.end():]
+
+
+def _run(cmd, cwd=None, input_text=None):
+    result = subprocess.run(cmd, cwd=cwd, input=input_text, capture_output=True, text=True)
+    if result.returncode:
+        output = (result.stderr or result.stdout).strip().splitlines()
+        raise RuntimeError(f"{os.path.basename(cmd[0])} failed: {output[-1] if output else result.returncode}")
+    return result.stdout
+
+
+def prepare_format(pdf_options, pandoc_version, format_dir=FORMAT_DIR):
+    """Returns (pandoc_options, message).
+
+    pandoc_options make the individual PDF runs use the precompiled preamble;
+    they are [] if no usable format could be made, and message says why.
+    """
+    if '--pdf-engine=xelatex' not in pdf_options:
+        return [], "the PDF engine is not xelatex"
+    xelatex = shutil.which('xelatex')
+    if not xelatex:
+        return [], "xelatex was not found"
+    try:
+        xelatex_version = _run([xelatex, '--version']).split('\n', 1)[0]
+        template = add_dump_point(_run(['pandoc', '-D', 'latex']))
+    except (OSError, RuntimeError) as e:
+        return [], str(e)
+    if template is None:
+        return [], "pandoc's LaTeX template has no \\documentclass line"
+
+    key = hash_parts('latex-format', FORMAT_VERSION, pandoc_version, xelatex_version, template, pdf_options)
+    work_dir = os.path.abspath(os.path.join(format_dir, key[:16]))
+    template_path = os.path.join(work_dir, 'policy.latex')
+    status_path = os.path.join(work_dir, 'status')
+    options = ['--template', template_path, f"--pdf-engine-opt=-fmt={os.path.join(work_dir, 'policy')}"]
+
+    # A format (or a failed attempt) for the same inputs is reused.
+    if os.path.exists(status_path):
+        os.utime(status_path)
+        with open(status_path, 'r') as f:
+            status = f.read().strip()
+        return (options, f"reusing {work_dir}") if status == 'ok' else ([], status)
+
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        with open(template_path, 'w') as f:
+            f.write(template)
+        preamble_options = [option for option in pdf_options if not option.startswith('--pdf-engine')]
+        _run(['pandoc', '--from=markdown', '--to=latex', '--standalone', '--template', template_path,
+              '-o', 'preamble.tex'] + preamble_options, cwd=work_dir, input_text='')
+        _run([xelatex, '-ini', '-interaction=nonstopmode', '-halt-on-error', '-jobname=policy',
+              '&xelatex', 'mylatexformat.ltx', 'preamble.tex'], cwd=work_dir)
+        if not os.path.exists(os.path.join(work_dir, 'policy.fmt')):
+            raise RuntimeError("xelatex did not write policy.fmt")
+        _run(['pandoc', '--from=markdown', '-o', 'probe.pdf'] + pdf_options + options,
+             cwd=work_dir, input_text=PROBE_MARKDOWN)
+        status = 'ok'
+    except (OSError, RuntimeError) as e:
+        # Recorded so later builds do not retry; delete the directory to try again.
+        status = f"format generation failed in {work_dir} ({e})"
+    with open(status_path, 'w') as f:
+        f.write(status + '\n')
+    prune_formats(format_dir)
+    return (options, f"built {work_dir}") if status == 'ok' else ([], status)
+
+
+def prune_formats(format_dir=FORMAT_DIR, keep=KEEP_FORMATS):
+    """Removes all but the most recently used format directories."""
+    entries = []
+    for name in os.listdir(format_dir):
+        status_path = os.path.join(format_dir, name, 'status')
+        if os.path.exists(status_path):
+            entries.append((os.path.getmtime(status_path), os.path.join(format_dir, name)))
+    for _, path in sorted(entries, reverse=True)[keep:]:
+        shutil.rmtree(path, ignore_errors=True)
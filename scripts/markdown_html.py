@@ -0,0 +1,354 @@
+"""A small GitHub Flavored Markdown to HTML renderer.
+
+Covers what the policy templates produce: ATX and setext headings with
+GitHub-style anchors, paragraphs, nested bullet and ordered lists, pipe tables
+with column alignment, block quotes, fenced and indented code, thematic breaks,
+and inline emphasis, strikethrough, code spans, links and autolinks. It is not
+a complete CommonMark implementation; anything it does not recognise is
+rendered as text.
+"""
+import html
+import re
+
+TAB_WIDTH = 4
+
+HEADING = re.compile(r'^ {0,3}(#{1,6})(?:[ \t]+(.*?))?(?:[ \t]+#+)?[ \t]*$')
+SETEXT_UNDERLINE = re.compile(r'^ {0,3}(=+|-+)[ \t]*$')
+THEMATIC_BREAK = re.compile(r'^ {0,3}([-*_])(?:[ \t]*\1){2,}[ \t]*$')
+FENCE = re.compile(r'^( {0,3})(`{3,}|~{3,})[ \t]*([^`\s]*)')
+BLOCK_QUOTE = re.compile(r'^ {0,3}> ?(.*)$')
+LIST_ITEM = re.compile(r'^( {0,3})([*+-]|\d{1,9}[.)])(?=[ \t]|$)([ \t]*)(.*)$')
+TABLE_DELIMITER = re.compile(r'^ {0,3}\|?[ \t]*:?-+:?[ \t]*(\|[ \t]*:?-+:?[ \t]*)*\|?[ \t]*$')
+
+CODE_SPAN = re.compile(r'(`+)(.+?)(?<!`)\1(?!`)', re.S)
+ESCAPE = re.compile(r'\\([!"#$%&\'()*+,\-./:;<=>?@\[\\\]^_`{|}~])')
+ANGLE_AUTOLINK = re.compile(r'<((?:https?|mailto):[^\s<>]+)>')
+LINK = re.compile(r'(!?)\[((?:[^\[\]]|\[[^\[\]]*\])*)\]\(\s*<?([^\s()<>]*(?:\([^\s()]*\)[^\s()<>]*)*)>?(?:\s+"([^"]*)")?\s*\)')
+BARE_URL = re.compile(r'(?<![\w/@])((?:https?://|www\.)[^\s<]*[^\s<.,:;"\')\]!?*_~])')
+EMAIL = re.compile(r'(?<![\w.+-])([\w.+-]+@[\w-]+(?:\.[\w-]+)+)(?![\w-])')
+STRONG = re.compile(r'(\*\*|__)(?=\S)(.+?)(?<=\S)\1')
+EMPHASIS = re.compile(r'\*(?=[^\s*])(.+?)(?<=[^\s*])\*|(?<![\w])_(?=[^\s_])(.+?)(?<=[^\s_])_(?![\w])')
+STRIKETHROUGH = re.compile(r'~~(?=\S)(.+?)(?<=\S)~~')
+PLACEHOLDER = re.compile(r'\x00(\d+)\x00')
+HARD_BREAK = re.compile(r'(?: {2,}|\\)\n')
+TAG = re.compile(r'<[^>]+>')
+
+
+def escape_text(text):
+    """Escapes text for HTML, leaving entity references such as &amp; or &#8212; alone."""
+    text = re.sub(r'&(?!#?\w+;)', '&amp;', text)
+    return text.replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;')
+
+
+class Slugger:
+    """Makes GitHub-style heading anchors that are unique within one page."""
+
+    def __init__(self, prefix=''):
+        self.prefix = prefix
+        self.used = set()
+
+    def slug(self, text):
+        base = self.prefix + re.sub(r'[^\w\- ]', '', text.strip().lower()).replace(' ', '-')
+        slug, n = base, 0
+        while slug in self.used:
+            n += 1
+            slug = f"{base}-{n}"
+        self.used.add(slug)
+        return slug
+
+
+def render_inline(text):
+    """Renders the inline Markdown of one paragraph, heading or table cell."""
+    stash = []
+
+    def keep(fragment):
+        stash.append(fragment)
+        return f"\x00{len(stash) - 1}\x00"
+
+    def link(match):
+        bang, label, url, title = match.groups()
+        title_attr = f' title="{escape_text(title)}"' if title else ''
+        if bang:
+            return keep(f'<img src="{escape_text(url)}" alt="{escape_text(label)}"{title_attr} />')
+        return keep(f'<a href="{escape_text(url)}"{title_attr}>{render_inline(label)}</a>')
+
+    def bare_url(match):
+        url = match.group(1)
+        href = url if '://' in url else 'http://' + url
+        return keep(f'<a href="{escape_text(href)}">{escape_text(url)}</a>')
+
+    text = CODE_SPAN.sub(lambda m: keep(f"<code>{escape_text(m.group(2).replace(chr(10), ' ').strip() or m.group(2))}</code>"), text)
+    text = ESCAPE.sub(lambda m: keep(escape_text(m.group(1))), text)
+    text = ANGLE_AUTOLINK.sub(lambda m: keep(f'<a href="{escape_text(m.group(1))}">{escape_text(m.group(1))}</a>'), text)
+    text = LINK.sub(link, text)
+    text = BARE_URL.sub(bare_url, text)
+    text = EMAIL.sub(lambda m: keep(f'<a href="mailto:{escape_text(m.group(1))}">{escape_text(m.group(1))}</a>'), text)
+    text = escape_text(text)
+    text = STRONG.sub(r'<strong>\2</strong>', text)
+    text = EMPHASIS.sub(lambda m: f"<em>{m.group(1) or m.group(2)}</em>", text)
+    text = STRIKETHROUGH.sub(r'<del>\1</del>', text)
+    text = HARD_BREAK.sub('<br />\n', text)
+    # Stashed fragments can contain other placeholders (e.g. code inside a link label).
+    while PLACEHOLDER.search(text):
+        text = PLACEHOLDER.sub(lambda m: stash[int(m.group(1))], text)
+    return text
+
+
+def plain_text(inline_html):
+    return html.unescape(TAG.sub('', inline_html))
+
+
+def leading_spaces(line):
+    return len(line) - len(line.lstrip(' '))
+
+
+def paragraph_line(line):
+    # Keep two trailing spaces: they mark a hard line break.
+    return line.lstrip() if line.endswith('  ') else line.strip()
+
+
+def parse_list_item(line):
+    """Returns (ordered, marker, start, content_indent, text) for a list item line, or None."""
+    match = LIST_ITEM.match(line)
+    if not match or THEMATIC_BREAK.match(line):
+        return None
+    indent, marker, spaces, text = match.groups()
+    if not text or len(spaces) > 4:
+        # An empty item, or one that starts with indented code: the content starts one space after the marker.
+        text = spaces[1:] + text if text else ''
+        spaces = ' '
+    ordered = marker[-1] in '.)'
+    return ordered, marker[-1], int(marker[:-1]) if ordered else None, len(indent) + len(marker) + len(spaces), text
+
+
+def split_table_row(line):
+    line = line.strip()
+    if line.startswith('|'):
+        line = line[1:]
+    if line.endswith('|') and not line.endswith('\\|'):
+        line = line[:-1]
+    return [cell.strip().replace('\\|', '|') for cell in re.split(r'(?<!\\)\|', line)]
+
+
+def starts_table(lines, i):
+    return (i + 1 < len(lines) and '|' in lines[i] and '|' in lines[i + 1]
+            and TABLE_DELIMITER.match(lines[i + 1]) is not None
+            and len(split_table_row(lines[i])) == len(split_table_row(lines[i + 1])))
+
+
+def interrupts_paragraph(line):
+    """True if the line starts a block that ends the paragraph before it."""
+    if HEADING.match(line) or THEMATIC_BREAK.match(line) or FENCE.match(line) or BLOCK_QUOTE.match(line):
+        return True
+    item = parse_list_item(line)
+    # As in GFM, only a non-empty item (and an ordered one only if it starts at 1) can interrupt a paragraph.
+    return bool(item and item[4].strip() and item[2] in (None, 1))
+
+
+class Renderer:
+    """Renders one Markdown document; collects its headings for a table of contents."""
+
+    def __init__(self, slugger=None):
+        self.slugger = slugger or Slugger()
+        self.headings = []
+
+    def heading(self, level, text):
+        inline = render_inline(text)
+        anchor = self.slugger.slug(plain_text(inline))
+        self.headings.append((level, anchor, inline))
+        return f'<h{level} id="{anchor}">{inline}</h{level}>'
+
+    def render(self, markdown):
+        lines = markdown.expandtabs(TAB_WIDTH).split('\n')
+        return '\n'.join(self.blocks(lines)) + '\n'
+
+    def blocks(self, lines, tight=False):
+        out = []
+        i = 0
+        while i < len(lines):
+            line = lines[i]
+            if not line.strip():
+                i += 1
+                continue
+
+            match = FENCE.match(line)
+            if match:
+                indent, fence, info = match.groups()
+                code = []
+                i += 1
+                while i < len(lines) and not re.match(rf'^ {{0,3}}{fence[0]}{{{len(fence)},}}[ \t]*$', lines[i]):
+                    code.append(lines[i][min(len(indent), leading_spaces(lines[i])):])
+                    i += 1
+                i += 1 # Skip the closing fence
+                language = f' class="language-{escape_text(info)}"' if info else ''
+                out.append(f"<pre><code{language}>{escape_text(chr(10).join(code))}\n</code></pre>")
+                continue
+
+            match = HEADING.match(line)
+            if match:
+                out.append(self.heading(len(match.group(1)), match.group(2) or ''))
+                i += 1
+                continue
+
+            if THEMATIC_BREAK.match(line):
+                out.append('<hr />')
+                i += 1
+                continue
+
+            if BLOCK_QUOTE.match(line):
+                quoted = []
+                while i < len(lines) and lines[i].strip():
+                    match = BLOCK_QUOTE.match(lines[i])
+                    quoted.append(match.group(1) if match else lines[i])
+                    i += 1
+                out.append('<blockquote>\n' + '\n'.join(self.blocks(quoted)) + '\n</blockquote>')
+                continue
+
+            if parse_list_item(line):
+                html_list, i = self.list_block(lines, i)
+                out.append(html_list)
+                continue
+
+            if starts_table(lines, i):
+                html_table, i = self.table(lines, i)
+                out.append(html_table)
+                continue
+
+            if leading_spaces(line) >= 4:
+                code = []
+                while i < len(lines) and (leading_spaces(lines[i]) >= 4 or not lines[i].strip()):
+                    code.append(lines[i][4:])
+                    i += 1
+                while code and not code[-1].strip():
+                    code.pop()
+                out.append(f"<pre><code>{escape_text(chr(10).join(code))}\n</code></pre>")
+                continue
+
+            # Paragraph: runs until a blank line or the start of another block.
+            paragraph = [paragraph_line(line)]
+            i += 1
+            setext_level = None
+            while i < len(lines) and lines[i].strip():
+                match = SETEXT_UNDERLINE.match(lines[i])
+                if match:
+                    setext_level = 1 if match.group(1)[0] == '=' else 2
+                    i += 1
+                    break
+                if interrupts_paragraph(lines[i]) or starts_table(lines, i):
+                    break
+                paragraph.append(paragraph_line(lines[i]))
+                i += 1
+            text = '\n'.join(paragraph).rstrip()
+            if setext_level:
+                out.append(self.heading(setext_level, text))
+            elif tight:
+                out.append(render_inline(text))
+            else:
+                out.append(f"<p>{render_inline(text)}</p>")
+        return out
+
+    def list_block(self, lines, i):
+        ordered, delimiter, start, _, _ = parse_list_item(lines[i])
+        items = []
+        loose = False
+        while i < len(lines):
+            item = parse_list_item(lines[i])
+            if not item or item[0] != ordered or item[1] != delimiter:
+                break
+            content_indent = item[3]
+            body = [item[4]]
+            i += 1
+            while i < len(lines):
+                line = lines[i]
+                if not line.strip():
+                    body.append('')
+                elif leading_spaces(line) >= content_indent:
+                    body.append(line[content_indent:])
+                elif body[-1] == '' or parse_list_item(line) or interrupts_paragraph(line):
+                    break
+                else:
+                    body.append(line) # Lazy continuation of the item's paragraph
+                i += 1
+            trailing_blank = False
+            while body and body[-1] == '':
+                body.pop()
+                trailing_blank = True
+            next_item = parse_list_item(lines[i]) if i < len(lines) else None
+            if trailing_blank and next_item and next_item[0] == ordered and next_item[1] == delimiter:
+                loose = True
+            if '' in body and not parse_list_item(body[body.index('') + 1]):
+                loose = True
+            items.append(body)
+
+        rendered_items = []
+        for body in items:
+            content = '\n'.join(self.blocks(body, tight=not loose))
+            rendered_items.append(f"<li>{content}</li>")
+        if ordered:
+            start_attr = f' start="{start}"' if start != 1 else ''
+            return f"<ol{start_attr}>\n" + '\n'.join(rendered_items) + "\n</ol>", i
+        return "<ul>\n" + '\n'.join(rendered_items) + "\n</ul>", i
+
+    def table(self, lines, i):
+        header = split_table_row(lines[i])
+        alignments = []
+        for cell in split_table_row(lines[i + 1]):
+            if cell.startswith(':') and cell.endswith(':'):
+                alignments.append(' style="text-align: center"')
+            elif cell.endswith(':'):
+                alignments.append(' style="text-align: right"')
+            elif cell.startswith(':'):
+                alignments.append(' style="text-align: left"')
+            else:
+                alignments.append('')
+        i += 2
+        rows = []
+        while i < len(lines) and lines[i].strip() and not interrupts_paragraph(lines[i]):
+            cells = split_table_row(lines[i])
+            rows.append((cells + [''] * len(header))[:len(header)])
+            i += 1
+
+        out = ['<table>', '<thead>', '<tr>']
+        out.extend(f"<th{align}>{render_inline(cell)}</th>" for cell, align in zip(header, alignments))
+        out.extend(['</tr>', '</thead>'])
+        if rows:
+            out.append('<tbody>')
+            for row in rows:
+                out.append('<tr>')
+                out.extend(f"<td{align}>{render_inline(cell)}</td>" for cell, align in zip(row, alignments))
+                out.append('</tr>')
+            out.append('</tbody>')
+        out.append('</table>')
+        return '\n'.join(out), i
+
+
+def render_markdown(markdown, slugger=None):
+    """Returns (html, headings) for a Markdown document.
+
+    headings is a list of (level, anchor, inline_html). Pass a shared Slugger to
+    keep anchors unique across several documents on one page.
+    """
+    renderer = Renderer(slugger)
+    return renderer.render(markdown), renderer.headings
+
+
+def render_toc(headings, depth=2):
+    """Returns a nested <ul> linking to the headings up to the given level."""
+    out = []
+    open_levels = []
+    for level, anchor, inline in headings:
+        if level > depth:
+            continue
+        while open_levels and open_levels[-1] > level:
+            out.append('</li>\n</ul>')
+            open_levels.pop()
+        if open_levels and open_levels[-1] == level:
+            out.append('</li>')
+        else:
+            out.append('<ul>')
+            open_levels.append(level)
+        out.append(f'<li><a href="#{anchor}">{inline}</a>')
+    while open_levels:
+        out.append('</li>\n</ul>')
+        open_levels.pop()
+    return '\n'.join(out)
@@ -0,0 +1,147 @@
+import html
+import os
+import re
+from collections import namedtuple
+from build_trace import progress
+from markdown_html import Slugger, render_markdown, render_toc
+from release_manifest import manifest_key
+
+# What a backend gets for every rendered policy. history_table is '' when the
+# policy has no release history to show. inputs_key is the document's key for
+# the manifest; pass it to release_manifest.manifest_key() and record the
+# result in builder.input_keys[path] for every file written.
+RenderedPolicy = namedtuple('RenderedPolicy', [
+    'policy_filename', 'rendered_filename', 'rendered_title', 'template_source', 'rendered_content', 'history_table',
+    'inputs_key',
+])
+
+
+class OutputBackend:
+    """An output format of the build.
+
+    write_document() writes a backend's files for one policy and runs in the
+    build's worker threads, so it must not keep per-document state on self.
+    write_combined() builds the tenant's combined manual once every document is
+    up to date. output_paths() lists the files write_document() produces; a
+    document whose files are missing is rebuilt on the next run.
+    combined_path() is the file write_combined() produces.
+    """
+    name = None
+
+    def __init__(self, builder):
+        self.builder = builder
+        self.tracer = builder.tracer
+
+    def output_paths(self, tenant, rendered_filename):
+        raise NotImplementedError
+
+    def combined_path(self, tenant):
+        raise NotImplementedError
+
+    def write_document(self, tenant, policy):
+        raise NotImplementedError
+
+    def write_combined(self, tenant):
+        raise NotImplementedError
+
+
+HTML_STYLE = """
+body { max-width: 52em; margin: 2em auto; padding: 0 1em; font-family: "Noto Sans", sans-serif; line-height: 1.5; }
+table { border-collapse: collapse; margin: 1em 0; }
+th, td { border: 1px solid #ccc; padding: 0.3em 0.6em; vertical-align: top; }
+th { background: #f4f4f4; }
+nav#TOC ul { list-style: none; padding-left: 1.2em; }
+section.policy { border-top: 1px solid #ccc; margin-top: 3em; }
+"""
+
+HTML_PAGE = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>{title}</title>
+<style>{style}</style>
+</head>
+<body>
+{body}</body>
+</html>
+"""
+
+HTML_HEADING = re.compile(r'<h([1-6]) id="([^"]*)">(.*?)</h\1>')
+
+
+class HtmlBackend(OutputBackend):
+    """Renders output/html/ in-process with markdown_html, without pandoc or LaTeX.
+
+    Each policy page shows the version history when md_show_revision_history is
+    set, like the Markdown output. The combined manual follows
+    combined_pdf_show_revision_history and gets a table of contents.
+    """
+    name = 'html'
+
+    def output_paths(self, tenant, rendered_filename):
+        stem = os.path.splitext(rendered_filename)[0]
+        return [
+            os.path.join(tenant.output_dir, 'html', stem + '.html'),
+            os.path.join(tenant.dirs[3], stem + '.html'),
+        ]
+
+    def combined_path(self, tenant):
+        return os.path.join(tenant.output_dir, 'html', 'combined_policies.html')
+
+    def write_document(self, tenant, policy):
+        config = tenant.config
+        page_path, fragment_path = self.output_paths(tenant, policy.rendered_filename)
+        os.makedirs(os.path.dirname(page_path), exist_ok=True)
+        progress(f"  -> Writing HTML: {page_path}", tenant.name, policy.policy_filename)
+
+        with self.tracer.span('html_render', policy=policy.policy_filename, tenant=tenant.name) as span:
+            page_history = config.get('md_show_revision_history', False)
+            page_content = policy.rendered_content
+            if page_history:
+                page_content += policy.history_table
+            body, _ = render_markdown(page_content)
+            with open(page_path, 'w') as f:
+                f.write(HTML_PAGE.format(title=html.escape(policy.rendered_title), style=HTML_STYLE, body=body))
+            self.builder.input_keys[page_path] = manifest_key('html', policy.inputs_key, page_history, HTML_PAGE, HTML_STYLE)
+
+            # The combined manual is one page, so its copy prefixes every anchor
+            # with the document name to keep them unique.
+            combined_content = policy.rendered_content
+            if config.get('combined_pdf_show_revision_history', False):
+                combined_content += policy.history_table
+            stem = os.path.splitext(policy.rendered_filename)[0]
+            fragment, _ = render_markdown(combined_content, Slugger(prefix=f"{stem}--"))
+            with open(fragment_path, 'w') as f:
+                f.write(fragment)
+            span['bytes'] = len(body) + len(fragment)
+
+    def write_combined(self, tenant):
+        config = tenant.config
+        combined_path = self.combined_path(tenant)
+        progress(f"Creating combined HTML: {combined_path}", tenant.name)
+        title = config.get('combined_pdf_title', 'Company Policy Manual')
+        author = config.get('combined_pdf_author', config.get('company_name', 'Company'))
+
+        with self.tracer.span('html_combined', tenant=tenant.name) as span:
+            sections = []
+            headings = []
+            for _, rendered_filename, _, _, _ in tenant.build_jobs:
+                with open(self.output_paths(tenant, rendered_filename)[1], 'r') as f:
+                    fragment = f.read()
+                headings.extend((int(level), anchor, text) for level, anchor, text in HTML_HEADING.findall(fragment))
+                sections.append(f'<section class="policy">\n{fragment}</section>\n')
+            body = (
+                f'<header>\n<h1 class="title">{html.escape(title)}</h1>\n<p class="author">{html.escape(author)}</p>\n</header>\n'
+                f'<nav id="TOC">\n{render_toc(headings, depth=2)}\n</nav>\n'
+                + ''.join(sections)
+            )
+            os.makedirs(os.path.dirname(combined_path), exist_ok=True)
+            with open(combined_path, 'w') as f:
+                f.write(HTML_PAGE.format(title=html.escape(title), style=HTML_STYLE, body=body))
+            span['bytes'] = len(body)
+        documents_key = tenant.documents_key()
+        if documents_key:
+            self.builder.input_keys[combined_path] = manifest_key(
+                'combined_html', documents_key, config.get('combined_pdf_show_revision_history', False),
+                title, author, HTML_PAGE, HTML_STYLE)
@@ -0,0 +1,968 @@
+import json
+import os
+import subprocess
+import time
+import yaml
+from build_trace import Tracer, progress
+from build_cache import BuildCache, DEFAULT_CACHE_DIR, DEFAULT_CACHE_MAX_BYTES, hash_file, hash_parts
+from build_scheduler import DEFAULT_COSTS_FILE, JobCosts, Scheduler, default_memory_budget_mb, note_cache_hit, run_measured
+from config_loader import load_yaml, parse_yaml
+from config_deps import DependencyGraph, DEFAULT_GRAPH_FILE, find_config_paths
+from derived_context import derive_context
+from git_history import DEFAULT_HISTORY_FILE
+from history_store import DEFAULT_RELEASE_PREFIX, HistoryStore
+from latex_format import prepare_format
+from output_backends import HtmlBackend, OutputBackend, RenderedPolicy
+from release_manifest import MANIFEST_FILE, MANIFEST_VERSION, artifact_entry, load_manifest, manifest_key, write_manifest
+from remote_cache import REMOTE_CACHE_ENV, REMOTE_CACHE_TOKEN_ENV, open_remote_cache
+from template_env import compile_inline, create_policy_environment
+
+CONFIG_PATH = 'conf/config.yaml'
+POLICY_DIR = 'policies'
+ORDER_FILE = 'conf/policy_order.yaml'
+BASE_OUTPUT_DIR = 'output'
+TENANT_BUILD_DIR = os.path.join('build', 'tenants')
+PANDOC_READER = 'gfm' # Use GitHub Flavored Markdown (fixes bullets)
+COMBINED_PDF_FILENAME = 'combined_policies.pdf'
+
+
+class PolicyBuildError(Exception):
+    """Raised when a single policy document fails to render or convert."""
+
+
+class Tenant:
+    """One config.yaml to build, with its own output directories and dependency graph."""
+
+    def __init__(self, name, config_path, output_dir=BASE_OUTPUT_DIR, graph_file=DEFAULT_GRAPH_FILE, tracer=None):
+        self.name = name
+        self.config_path = config_path
+        self.label = f"[{name}] " if name else ""
+        self.output_dir = output_dir
+        self.tracer = tracer or Tracer()
+        self.load_config()
+
+        # --- Output Directories ---
+        self.dirs = [
+            os.path.join(output_dir, 'md'),
+            os.path.join(output_dir, 'pdf'),
+            os.path.join(output_dir, 'odt'),
+            os.path.join(output_dir, 'temp_combined')
+        ]
+        for d in self.dirs:
+            os.makedirs(d, exist_ok=True)
+
+        self.dependency_graph = DependencyGraph(graph_file)
+        self.reset()
+
+    def load_config(self):
+        """(Re)reads the tenant's config and the pandoc options derived from it."""
+        print(f"{self.label}Loading config from {self.config_path}")
+        try:
+            with self.tracer.span('yaml_load', file=self.config_path, tenant=self.name) as span, open(self.config_path, 'rb') as f:
+                source = f.read()
+                span['bytes'] = len(source)
+                config = parse_yaml(source)
+        except yaml.YAMLError as e:
+            raise PolicyBuildError(f"Failed to parse {self.config_path}. Please check for syntax errors.\nParser error: {e}")
+        except OSError as e:
+            raise PolicyBuildError(f"Could not read {self.config_path}: {e}")
+        self.set_config(config)
+
+    def set_config(self, config):
+        """Uses an already parsed config, e.g. one shared with the validator."""
+        if not isinstance(config, dict):
+            raise PolicyBuildError(f"{self.config_path} does not contain a YAML mapping.")
+        self.config = config
+        # Templates render against the config plus indexes such as vendors_by_service,
+        # computed once here instead of in every template loop.
+        self.context = derive_context(config)
+
+        # --- Get PDF Font settings from config ---
+        pdf_font = self.config.get('pdf_main_font', 'Noto Sans')
+        pdf_header_font = self.config.get('pdf_header_font', pdf_font) # Default to main font if not set
+        pdf_code_font = self.config.get('pdf_code_font', 'Noto Sans Mono') # Good default
+        self.odt_reference_doc = self.config.get('pdf_odt_reference_doc') # Path to a reference ODT file
+        self.odt_reference_doc_hash = hash_file(self.odt_reference_doc)
+
+        # Define common pandoc PDF options to reduce duplication
+        self.common_pdf_options = [
+            '--pdf-engine=xelatex',
+            '--variable', f"mainfont={pdf_font}",
+            '--variable', f"sansfont={pdf_header_font}",
+            '--variable', f"monofont={pdf_code_font}"
+        ]
+        # Set by Builder.prepare_pdf_format() when a precompiled preamble is available.
+        self.pdf_format_options = []
+
+    def reset(self):
+        """Clears the per-run job lists so the tenant can be planned again (watch mode)."""
+        self.build_jobs = []
+        self.planned_jobs = []
+        self.processed_for_combined_pdf = []
+        self.failed_policies = []
+        # {policy: history table without the global release row}, set on a global release.
+        self.release_histories = {}
+
+    def output_paths(self, rendered_filename):
+        """Returns the MD, PDF, ODT and combined-AST paths written for a document."""
+        return [
+            os.path.join(self.dirs[0], rendered_filename),
+            os.path.join(self.dirs[1], rendered_filename.replace('.md', '.pdf')),
+            os.path.join(self.dirs[2], rendered_filename.replace('.md', '.odt')),
+            os.path.join(self.dirs[3], rendered_filename.replace('.md', '.json')),
+        ]
+
+    def inputs_key_path(self, rendered_filename):
+        """The file holding a document's inputs key (see Builder.process_policy)."""
+        return os.path.join(self.dirs[3], rendered_filename.replace('.md', '.key'))
+
+    def documents_key(self):
+        """Returns a hash over the inputs keys of every document, in order, or None if one is missing."""
+        keys = []
+        for _, rendered_filename, _, _, _ in self.build_jobs:
+            try:
+                with open(self.inputs_key_path(rendered_filename), 'r') as f:
+                    keys.append(f.read().strip())
+            except OSError:
+                return None
+        return hash_parts('documents', keys)
+
+
+def load_batch_tenants(batch_path):
+    """Returns (name, config_path) pairs from a directory of configs or a manifest file."""
+    if os.path.isdir(batch_path):
+        return [
+            (os.path.splitext(name)[0], os.path.join(batch_path, name))
+            for name in sorted(os.listdir(batch_path))
+            if name.endswith(('.yaml', '.yml'))
+        ]
+    manifest = load_yaml(batch_path) or {}
+    manifest_dir = os.path.dirname(batch_path)
+    return [
+        (entry['name'], os.path.join(manifest_dir, entry['config']))
+        for entry in manifest.get('tenants', [])
+    ]
+
+
+def build_markdown_table(commits):
+    """Helper function to build the markdown table from a list of commits."""
+    table = "\n\n## Version History\n\n"
+    table += "| Date | Updated By | Commit | Comments |\n"
+    table += "| :--- | :--- | :--- | :--- |\n"
+
+    for commit in commits:
+        hash_short = commit['hash'][:7]
+        table += f"| {commit['date']} | {commit['author_name']} | {hash_short} | {commit['subject']} |\n"
+
+    return table
+
+
+def run_pandoc(cmd, input_text=None):
+    """Runs a pandoc command and returns its stdout, raising PolicyBuildError with pandoc's stderr on failure."""
+    try:
+        return run_measured(cmd, input_text)
+    except subprocess.CalledProcessError as e:
+        raise PolicyBuildError(f"Pandoc stderr:\n{e.stderr}")
+
+
+def merge_asts(asts):
+    """Concatenates pandoc JSON ASTs into one document.
+
+    Pandoc's reader makes repeated heading identifiers unique with a -1, -2, ...
+    suffix when it parses one file; the same is done here across documents, so
+    the TOC links and PDF bookmarks of the combined manual stay unique.
+    """
+    seen = set()
+    blocks = []
+    for ast in asts:
+        for block in ast['blocks']:
+            if block.get('t') == 'Header':
+                level, (identifier, classes, attributes), inlines = block['c']
+                unique, n = identifier, 0
+                while unique and unique in seen:
+                    n += 1
+                    unique = f"{identifier}-{n}"
+                seen.add(unique)
+                if unique != identifier:
+                    block = {'t': 'Header', 'c': [level, [unique, classes, attributes], inlines]}
+            blocks.append(block)
+    return {'pandoc-api-version': asts[0]['pandoc-api-version'], 'meta': {}, 'blocks': blocks}
+
+
+LATEX_SPECIAL_CHARS = {
+    '\\': r'\textbackslash{}', '&': r'\&', '%': r'\%', '$': r'\$', '#': r'\#',
+    '_': r'\_', '{': r'\{', '}': r'\}', '~': r'\textasciitilde{}', '^': r'\textasciicircum{}',
+}
+
+
+def latex_escape(text):
+    return ''.join(LATEX_SPECIAL_CHARS.get(ch, ch) for ch in text)
+
+
+def build_stitched_document(pdf_entries):
+    """Builds the pandoc Markdown that stitches already-built PDFs into one manual.
+
+    Each entry in pdf_entries is a (title, pdf_path) pair. The pages are pulled in
+    with pdfpages' \\includepdf, which also adds a TOC line and a PDF bookmark for
+    the first page of every policy, so LaTeX only has to typeset the title page
+    and the table of contents.
+    """
+    lines = []
+    for i, (title, pdf_path) in enumerate(pdf_entries):
+        # pandoc runs xelatex in a temporary directory, so paths must be absolute.
+        abs_path = os.path.abspath(pdf_path).replace(os.sep, '/')
+        lines.append(
+            f"\\includepdf[pages=-,addtotoc={{1,chapter,0,{{{latex_escape(title)}}},policy-{i}}}]"
+            f"{{{abs_path}}}"
+        )
+    return '\n\n'.join(lines) + '\n'
+
+
+class PandocBackend(OutputBackend):
+    """PDF and ODT for every policy and the combined PDF, written by pandoc from the cached AST."""
+    name = 'pandoc'
+
+    def output_paths(self, tenant, rendered_filename):
+        return tenant.output_paths(rendered_filename)[1:]
+
+    def combined_path(self, tenant):
+        return os.path.join(tenant.dirs[1], COMBINED_PDF_FILENAME)
+
+    def write_document(self, tenant, policy):
+        self.builder.convert_policy(tenant, policy)
+
+    def write_combined(self, tenant):
+        self.builder.build_combined_pdf(tenant)
+
+
+OUTPUT_BACKENDS = {
+    'pandoc': PandocBackend,
+    'html': HtmlBackend,
+}
+
+
+def add_build_arguments(parser):
+    """Adds the options shared by process_policies.py and build.py to an ArgumentParser.
+
+    build_options() turns the parsed options into Builder keyword arguments.
+    """
+    parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count() or 1,
+                        help="Number of documents to render and convert in parallel (default: number of CPU cores).")
+    parser.add_argument('--memory-budget-mb', type=int,
+                        help="Start no more conversions at once than fit in this many MB, by each document's peak "
+                             "memory in earlier builds (default: 75%% of physical memory).")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Ignore the build and template caches: recompile every template and run pandoc for every document.")
+    parser.add_argument('--precompile-templates', action='store_true',
+                        help="Only compile every policy template into the Jinja bytecode cache, then exit.")
+    parser.add_argument('--plan', action='store_true',
+                        help="Print which documents would be rebuilt and why, then exit without building.")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                        help=f"Directory for cached PDF/ODT artifacts (default: {DEFAULT_CACHE_DIR}).")
+    parser.add_argument('--cache-max-mb', type=int, default=DEFAULT_CACHE_MAX_BYTES // (1024 * 1024),
+                        help="Evict least recently used cache entries above this size in MB (default: %(default)s).")
+    parser.add_argument('--remote-cache', metavar='URL|DIR', default=os.environ.get(REMOTE_CACHE_ENV),
+                        help="Shared artifact cache to read misses from and upload new artifacts to: an http(s) URL "
+                             "answering GET/PUT <url>/<entry>, or a directory such as a network share. A bearer token "
+                             f"is read from ${REMOTE_CACHE_TOKEN_ENV} (default: ${REMOTE_CACHE_ENV}).")
+    parser.add_argument('--remote-cache-read-only', action='store_true',
+                        help="Download from the remote cache but never upload to it, e.g. for pull request builds.")
+    parser.add_argument('--no-precompiled-preamble', action='store_false', dest='precompile_preamble',
+                        help="Do not dump the shared LaTeX preamble into a precompiled xelatex format; every PDF "
+                             "loads it in full.")
+    parser.add_argument('--combined-mode', choices=['typeset', 'stitch'], default='typeset',
+                        help="'typeset' runs the combined Markdown through pandoc/xelatex again; 'stitch' joins the "
+                             "individual PDFs behind a generated title page and TOC, so it needs "
+                             "pdf_show_revision_history and combined_pdf_show_revision_history to match "
+                             "(default: %(default)s).")
+    parser.add_argument('--backend', action='append', choices=sorted(OUTPUT_BACKENDS), dest='backends',
+                        help="Output format to write; repeat for several. 'pandoc' writes PDF and ODT, 'html' writes "
+                             "output/html/ in-process without pandoc or LaTeX (default: pandoc).")
+    parser.add_argument('--trace', metavar='FILE',
+                        help="Write a Chrome/Perfetto trace of every build stage to FILE and print a timing summary.")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="With --trace, also record tracemalloc peaks for each span (slows the build down).")
+
+
+def build_options(args):
+    """Returns the Builder keyword arguments for options added by add_build_arguments()."""
+    return {
+        'jobs': args.jobs, 'no_cache': args.no_cache, 'cache_dir': args.cache_dir,
+        'cache_max_bytes': args.cache_max_mb * 1024 * 1024, 'combined_mode': args.combined_mode,
+        'backends': args.backends or ['pandoc'], 'remote_cache': args.remote_cache,
+        'remote_cache_read_only': args.remote_cache_read_only, 'memory_budget_mb': args.memory_budget_mb,
+        'precompile_preamble': args.precompile_preamble,
+    }
+
+
+class Builder:
+    """Renders and converts the policy documents for one or more tenants.
+
+    Holds everything the tenants of a run share: the Jinja environment, the
+    policy order, the version history, the build cache, the output backends and
+    the worker options.
+    Nothing is read until the load_* methods are called, so the builder can be
+    embedded in another process and fed already-parsed state with set_history().
+    """
+
+    def __init__(self, policy_dir=POLICY_DIR, order_file=ORDER_FILE, jobs=None, no_cache=False,
+                 cache_dir=DEFAULT_CACHE_DIR, cache_max_bytes=DEFAULT_CACHE_MAX_BYTES,
+                 combined_mode='typeset', backends=('pandoc',), remote_cache=None, remote_cache_read_only=False,
+                 memory_budget_mb=None, costs_file=DEFAULT_COSTS_FILE, precompile_preamble=True, tracer=None):
+        self.policy_dir = policy_dir
+        self.order_file = order_file
+        self.jobs = jobs or os.cpu_count() or 1
+        self.no_cache = no_cache
+        self.combined_mode = combined_mode
+        # Conversions are started longest first, and no more at once than fit in the
+        # memory budget, using each job's wall time and peak RSS from earlier builds.
+        self.memory_budget_mb = memory_budget_mb or default_memory_budget_mb()
+        self.job_costs = JobCosts(costs_file)
+        # xelatex starts from a format with the shared preamble already loaded (see latex_format.py).
+        self.precompile_preamble = precompile_preamble
+        self.pdf_formats = {}
+        # {output path: build cache key} of the artifacts converted this run, for the manifest.
+        self.input_keys = {}
+        self.tracer = tracer or Tracer()
+
+        # Compiled templates are kept in build/jinja_cache/ and reused until their source changes.
+        self.env = create_policy_environment(policy_dir, use_cache=not no_cache)
+
+        # PDFs and ODTs are looked up by a hash of everything that affects them, so an
+        # unchanged policy is copied from build/cache/ instead of going through pandoc.
+        # The cache is content-addressed, so tenants with identical documents share entries.
+        # A remote cache (a shared directory or an HTTP store, see remote_cache.py) lets
+        # CI runners and workstations reuse each other's artifacts; a URL, a path or a RemoteCache.
+        if isinstance(remote_cache, str):
+            remote_cache = open_remote_cache(remote_cache, read_only=remote_cache_read_only)
+        self.remote_cache = remote_cache if not no_cache else None
+        self.build_cache = BuildCache(cache_dir, cache_max_bytes, enabled=not no_cache, remote=self.remote_cache)
+        # Every rendered Markdown text is parsed into pandoc's JSON AST once; the
+        # PDF, ODT and combined writers all read the AST instead of the Markdown.
+        # It lives inside cache_dir, so evict() bounds both caches together.
+        self.ast_cache = BuildCache(os.path.join(cache_dir, 'ast'), cache_max_bytes, enabled=not no_cache,
+                                    remote=self.remote_cache)
+        try:
+            self.pandoc_version = subprocess.run(['pandoc', '--version'], capture_output=True, text=True).stdout.split('\n', 1)[0]
+        except OSError:
+            self.pandoc_version = ''
+
+        # Output formats written for every document: names from OUTPUT_BACKENDS or OutputBackend instances.
+        self.backends = [OUTPUT_BACKENDS[b](self) if isinstance(b, str) else b for b in backends]
+
+        self.policy_files = []
+        self.set_history({})
+
+    # --- Shared Inputs ---
+    def load_policy_order(self):
+        """Reads the policy_files list from the order file. Raises on a read or parse error."""
+        print(f"Loading policy order from {self.order_file}")
+        with self.tracer.span('yaml_load', file=self.order_file):
+            policy_order_config = load_yaml(self.order_file)
+        self.policy_files = policy_order_config.get('policy_files', [])
+        return self.policy_files
+
+    def load_history(self, history_file=DEFAULT_HISTORY_FILE):
+        """Opens the history written by get_git_history.py. A missing file means no history tables.
+
+        Only the store's metadata is read here; each document's rows are fetched
+        when its history table is built. A legacy .json export is also accepted.
+        """
+        print(f"Loading history from {history_file}")
+        try:
+            with self.tracer.span('history_load', file=history_file):
+                if history_file.endswith('.json'):
+                    with open(history_file, 'r') as f:
+                        self.set_history(json.load(f))
+                else:
+                    self.history = HistoryStore.open(history_file)
+        except Exception as e:
+            print(f"Could not load history file: {e}")
+            self.history = None
+
+    def set_history(self, history_data):
+        """Uses history data as returned by git_history.export_history()."""
+        self.history = HistoryStore.from_data(history_data) if history_data else None
+
+    def create_tenant(self, name='', config_path=CONFIG_PATH, output_dir=BASE_OUTPUT_DIR, graph_file=DEFAULT_GRAPH_FILE):
+        tenant = Tenant(name, config_path, output_dir, graph_file, tracer=self.tracer)
+        # A stitched manual is made of the individual PDFs, so it shows their
+        # history tables whatever combined_pdf_show_revision_history says.
+        config = tenant.config
+        if self.combined_mode == 'stitch' and (bool(config.get('pdf_show_revision_history', False))
+                                               != bool(config.get('combined_pdf_show_revision_history', False))):
+            raise PolicyBuildError(
+                f"{config_path}: --combined-mode stitch needs pdf_show_revision_history and "
+                f"combined_pdf_show_revision_history to match, because the stitched manual reuses the individual PDFs.")
+        return tenant
+
+    # --- Helper Function to Generate History Table ---
+    def get_history_table(self, tenant, policy_filename, release_stamp=True):
+        """Returns the Markdown history table of a policy.
+
+        With release_stamp=False a global release is ignored, which gives the
+        table the document would have had without it.
+        """
+        config = tenant.config
+        history = self.history
+        if history is None or not history.current_build_commit:
+            return "" # Can't build history if build commit info is missing
+        current_build_commit = history.current_build_commit
+        is_global_release = history.is_global_release and release_stamp
+        global_hash = current_build_commit['hash'] if is_global_release else None
+
+        # 1. Handle Global Release based on the configured style
+        if is_global_release:
+            print(f"  -> Global release detected. Stamping with commit {current_build_commit['hash'][:7]}")
+
+            # Check the style: 'replace' or 'append'
+            history_style = config.get('global_release_history_style', 'append')
+            if history_style == 'replace':
+                print("     -> History style is 'replace'. Showing only the global release commit.")
+                # Show *only* the global release commit, as recorded for this file if it touched it
+                return build_markdown_table([history.commit(policy_filename, global_hash) or current_build_commit])
+
+        # 2. Fetch only this file's release commits. A commit is included if:
+        #   a) It is the current global release commit (if applicable).
+        #   b) Its subject starts with the release/hotfix prefix.
+        prefix = config.get('release_commit_prefix', DEFAULT_RELEASE_PREFIX)
+        commits = history.release_commits(policy_filename, prefix, include_hash=global_hash)
+
+        # 3. Add the global commit to the history for every file that it did not touch.
+        if global_hash and not any(commit['hash'] == global_hash for commit in commits):
+            commits = [current_build_commit] + commits
+
+        if not commits:
+            return ""
+
+        # 4. Build the markdown table
+        return build_markdown_table(commits)
+
+    def convert_cached(self, stage, cmd, input_text, output_path, cache_key, input_key=None, **fields):
+        """Copies output_path from the build cache, or runs pandoc and stores the result.
+
+        input_key is recorded for the manifest; it defaults to cache_key.
+        """
+        self.input_keys[output_path] = input_key or cache_key
+        with self.tracer.span(stage, output=output_path, input_bytes=len(input_text or ''), **fields) as span:
+            span['cached'] = self.build_cache.fetch(cache_key, output_path)
+            if span['cached']:
+                note_cache_hit()
+                progress(f"  -> (cached) {output_path}", fields.get('tenant'), fields.get('policy'))
+            else:
+                run_pandoc(cmd, input_text)
+                self.build_cache.store(cache_key, output_path)
+            span['output_bytes'] = os.path.getsize(output_path)
+
+    def markdown_ast(self, markdown, **fields):
+        """Returns the pandoc JSON AST of a Markdown text, running the reader only once per content hash."""
+        cache_key = hash_parts('ast', self.pandoc_version, PANDOC_READER, markdown)
+        with self.tracer.span('pandoc_parse', input_bytes=len(markdown), **fields) as span:
+            data = self.ast_cache.read(cache_key, '.json')
+            span['cached'] = data is not None
+            if data is None:
+                data = run_pandoc(['pandoc', f'--from={PANDOC_READER}', '--to=json'], markdown).encode('utf-8')
+                self.ast_cache.write(cache_key, '.json', data)
+            span['output_bytes'] = len(data)
+        return json.loads(data)
+
+    # --- Render & Convert ---
+    def render_policy(self, policy_filename, context, tenant_name=''):
+        """Renders one policy template with a render context (see derive_context) and returns the Markdown."""
+        with self.tracer.span('template_compile', policy=policy_filename, tenant=tenant_name):
+            template = self.env.get_template(policy_filename)
+        with self.tracer.span('jinja_render', policy=policy_filename, tenant=tenant_name) as span:
+            rendered_content = template.render(context)
+            span['bytes'] = len(rendered_content)
+        return rendered_content
+
+    def process_policy(self, tenant, policy_filename, rendered_filename, rendered_title, history_table, convert=True):
+        """Renders one policy to MD and hands it to every output backend (PDF and ODT by default).
+
+        Returns the path of the pandoc AST written for the combined PDF. With
+        convert=False only the Markdown file is written (used by --watch).
+        Runs inside a worker thread, so it must not call exit().
+
+        The document's inputs key, a hash of its content and its history table
+        without the global release row, is written next to the AST. The
+        manifest_key() of every artifact is derived from it, so a global
+        release that only adds its own row to each table changes no artifact
+        in the manifest.
+        """
+        config = tenant.config
+        md_path, _, _, temp_combined_path = tenant.output_paths(rendered_filename)
+
+        # 1. Render Jinja2 template (use the *source* filename)
+        rendered_content = self.render_policy(policy_filename, tenant.context, tenant.name)
+        template_source = self.env.loader.get_source(self.env, policy_filename)[0]
+        release_history = tenant.release_histories.get(policy_filename, history_table)
+        inputs_key = hash_parts('document', rendered_filename, rendered_title, rendered_content, release_history)
+        with open(tenant.inputs_key_path(rendered_filename), 'w') as f:
+            f.write(inputs_key + '\n')
+
+        # 3. Apply history based on config toggles
+        md_history = config.get('md_show_revision_history', False)
+        md_content = rendered_content
+        if md_history:
+            md_content += history_table
+
+        # 5. Save Processed Markdown
+        with open(md_path, 'w') as out_f:
+            out_f.write(md_content)
+        self.input_keys[md_path] = manifest_key('md', inputs_key, md_history)
+
+        if not convert:
+            return temp_combined_path
+
+        policy = RenderedPolicy(policy_filename, rendered_filename, rendered_title, template_source,
+                                rendered_content, history_table, inputs_key)
+        for backend in self.backends:
+            backend.write_document(tenant, policy)
+        return temp_combined_path
+
+    def convert_policy(self, tenant, policy):
+        """Writes a rendered policy's PDF, ODT and AST for the combined PDF with pandoc."""
+        config = tenant.config
+        policy_filename, rendered_filename, rendered_title, template_source, rendered_content, history_table, inputs_key = policy
+        _, pdf_path, odt_path, temp_combined_path = tenant.output_paths(rendered_filename)
+
+        pdf_content = rendered_content
+        pdf_history = config.get('pdf_show_revision_history', False)
+        if pdf_history:
+            pdf_content += history_table
+
+        combined_history = config.get('combined_pdf_show_revision_history', False)
+
+        # 6. Parse the policy and its history table once; every writer below reads the AST.
+        # The history table starts with a blank line, so joining the two block lists
+        # gives the same document as parsing the joined Markdown.
+        rendered_ast = self.markdown_ast(rendered_content, policy=policy_filename, tenant=tenant.name)
+        history_ast = self.markdown_ast(history_table, policy=policy_filename, tenant=tenant.name) if history_table else None
+
+        def document_ast(with_history):
+            return merge_asts([rendered_ast, history_ast] if with_history and history_ast else [rendered_ast])
+
+        pdf_ast = json.dumps(document_ast(pdf_history))
+
+        # 7. Save the AST for the Combined PDF
+        with open(temp_combined_path, 'w') as out_f:
+            json.dump(document_ast(combined_history), out_f)
+
+        # --- Create Individual PDF ---
+        progress(f"  -> Converting to individual PDF: {pdf_path}", tenant.name, policy_filename)
+
+        pandoc_cmd_individual = [
+            'pandoc',
+            '--from=json',
+            '-o', pdf_path,
+            '--metadata', f"title={rendered_title}", # Use friendly title
+        ] + tenant.common_pdf_options + tenant.pdf_format_options
+
+        try:
+            # pdf_format_options only change how xelatex starts, not the PDF, so they are not part of the key.
+            pdf_key = hash_parts('pdf', self.pandoc_version, PANDOC_READER, template_source, rendered_content,
+                                 history_table, pdf_content, rendered_title, tenant.common_pdf_options)
+            self.convert_cached('pandoc_pdf', pandoc_cmd_individual, pdf_ast, pdf_path, pdf_key,
+                                manifest_key('pdf', inputs_key, pdf_history, self.pandoc_version, tenant.common_pdf_options),
+                                policy=policy_filename, tenant=tenant.name)
+        except PolicyBuildError as e:
+            raise PolicyBuildError(f"Pandoc failed to create individual PDF.\n{e}")
+
+        # 8. Create Individual ODT
+        progress(f"  -> Converting to individual ODT: {odt_path}", tenant.name, policy_filename)
+
+        pandoc_cmd_odt = [
+            'pandoc',
+            '--from=json',
+            '-o', odt_path,
+            '--metadata', f"title={rendered_title}"
+        ]
+
+        # Add reference doc for styling if it's defined in the config
+        if tenant.odt_reference_doc and os.path.exists(tenant.odt_reference_doc):
+            pandoc_cmd_odt.extend(['--reference-doc', tenant.odt_reference_doc])
+
+        try:
+            odt_key = hash_parts('odt', self.pandoc_version, PANDOC_READER, template_source, rendered_content,
+                                 history_table, pdf_content, rendered_title, tenant.odt_reference_doc_hash)
+            self.convert_cached('pandoc_odt', pandoc_cmd_odt, pdf_ast, odt_path, odt_key,
+                                manifest_key('odt', inputs_key, pdf_history, self.pandoc_version, tenant.odt_reference_doc_hash),
+                                policy=policy_filename, tenant=tenant.name)
+        except PolicyBuildError as e:
+            raise PolicyBuildError(f"Pandoc failed to create individual ODT.\n{e}")
+
+    # --- Plan ---
+    def plan_tenant(self, tenant, show_skipped=True, convert=True):
+        """Resolves the order entries for a tenant and decides which documents to rebuild.
+
+        With convert=False only the Markdown outputs need to exist for a document
+        to count as up to date.
+        """
+        context = tenant.context
+        env = self.env
+
+        # Resolve the output filename and title of every entry up front, so the
+        # combined PDF keeps the policy_order.yaml order whatever order the workers finish in.
+        for policy_item in self.policy_files:
+            try:
+                policy_filename = policy_item['source']
+                output_filename_template = policy_item['output']
+                # Get the new 'title' field, default to the output filename
+                policy_title_template = policy_item.get('title', output_filename_template.replace('.md', ''))
+            except (TypeError, KeyError):
+                print(f"  -> WARNING: Skipping malformed item in {self.order_file}. Must be a list of objects with 'source' and 'output' keys.")
+                print(f"     Item: {policy_item}")
+                continue
+
+            # Render the *output* filename
+            filename_template = compile_inline(output_filename_template)
+            rendered_filename = filename_template.render(context)
+
+            # Render the *PDF title*
+            title_template = compile_inline(policy_title_template)
+            rendered_title = title_template.render(context)
+
+            # The order entry's own templates can read config too (e.g. {{ company }}).
+            order_entry = [output_filename_template, policy_title_template]
+            order_paths = []
+            for source in order_entry:
+                order_paths.extend(find_config_paths(env.parse(source)))
+
+            tenant.build_jobs.append((policy_filename, rendered_filename, rendered_title, order_entry, order_paths))
+
+        # The dependency graph records which config paths each template reads, so a
+        # config edit only rebuilds the documents that read the changed keys.
+        dependency_graph = tenant.dependency_graph
+        print(f"{tenant.label}Build plan:")
+        for policy_filename, rendered_filename, rendered_title, order_entry, order_paths in tenant.build_jobs:
+            # 2. Generate history table (use *source* filename to look up)
+            with self.tracer.span('history_table', policy=policy_filename, tenant=tenant.name) as span:
+                history_table = self.get_history_table(tenant, policy_filename)
+                span['bytes'] = len(history_table)
+                if self.history is not None and self.history.is_global_release:
+                    tenant.release_histories[policy_filename] = self.get_history_table(tenant, policy_filename,
+                                                                                       release_stamp=False)
+            try:
+                template_source = env.loader.get_source(env, policy_filename)[0]
+            except Exception as e:
+                tenant.planned_jobs.append((policy_filename, rendered_filename, rendered_title, history_table, None, True))
+                print(f"  rebuild {policy_filename}: {e}")
+                continue
+
+            template_hash = hash_parts(template_source)
+            template_paths = dependency_graph.cached_paths(policy_filename, template_hash)
+            if template_paths is None:
+                template_paths = list(find_config_paths(env.parse(template_source, policy_filename)))
+            current_inputs = dependency_graph.describe(context, template_hash, template_paths + order_paths,
+                                                       order_entry, history_table)
+
+            if self.no_cache:
+                reasons = ['--no-cache']
+            else:
+                reasons = dependency_graph.changes(policy_filename, current_inputs)
+                required_outputs = tenant.output_paths(rendered_filename)[:1] + [tenant.inputs_key_path(rendered_filename)]
+                if convert:
+                    required_outputs += [path for backend in self.backends
+                                         for path in backend.output_paths(tenant, rendered_filename)]
+                if not reasons and not all(os.path.exists(p) for p in required_outputs):
+                    reasons = ['output missing']
+
+            if reasons:
+                print(f"  rebuild {policy_filename}: {'; '.join(reasons)}")
+            elif show_skipped:
+                print(f"  skip    {policy_filename}: up to date")
+            tenant.planned_jobs.append((policy_filename, rendered_filename, rendered_title, history_table,
+                                        current_inputs, bool(reasons)))
+
+    # --- Combined Manual ---
+    def build_combined_pdf(self, tenant):
+        """Creates the tenant's combined PDF. Raises PolicyBuildError on failure."""
+        config = tenant.config
+        combined_pdf_path = os.path.join(tenant.dirs[1], COMBINED_PDF_FILENAME)
+        progress(f"Creating combined PDF: {combined_pdf_path}", tenant.name)
+
+        combined_pdf_title = config.get('combined_pdf_title', 'Company Policy Manual')
+        combined_pdf_author = config.get('combined_pdf_author', config.get('company_name', 'Company'))
+        documents_key = tenant.documents_key()
+        input_key = documents_key and manifest_key(
+            'combined_pdf', documents_key, config.get('combined_pdf_show_revision_history', False), self.pandoc_version,
+            self.combined_mode, combined_pdf_title, combined_pdf_author, tenant.common_pdf_options)
+
+        if self.combined_mode == 'stitch':
+            # Join the individual PDFs instead of re-typesetting every policy.
+            stitched_entries = [
+                (rendered_title, tenant.output_paths(rendered_filename)[1])
+                for _, rendered_filename, rendered_title, _, _ in tenant.build_jobs
+            ]
+            stitched_document = build_stitched_document(stitched_entries)
+            pandoc_cmd_combined = [
+                'pandoc',
+                '--from=markdown', # Pandoc Markdown passes the raw \\includepdf commands through
+                '-o', combined_pdf_path,
+                '--table-of-contents',
+                '--toc-depth=1',
+                '--variable', 'documentclass=report', # Gives the title page and the TOC their own pages
+                '--variable', 'header-includes=\\usepackage{pdfpages}',
+                '--metadata', f"title={combined_pdf_title}",
+                '--metadata', f"author={combined_pdf_author}",
+            ] + tenant.common_pdf_options
+            combined_input = stitched_document
+            combined_key = hash_parts('stitched', self.pandoc_version, combined_pdf_title, combined_pdf_author,
+                                      tenant.common_pdf_options, stitched_document,
+                                      *[hash_file(pdf_path) for _, pdf_path in stitched_entries])
+        else:
+            pandoc_cmd_combined = [
+                'pandoc',
+                '--from=json', # The policies' cached ASTs, joined below
+                '-o', combined_pdf_path,
+                '--table-of-contents',
+                '--toc-depth=2',
+                '--number-sections',
+                '--metadata', f"title={combined_pdf_title}",
+                '--metadata', f"author={combined_pdf_author}",
+            ] + tenant.common_pdf_options + tenant.pdf_format_options
+
+            combined_asts = []
+            for path in tenant.processed_for_combined_pdf:
+                with open(path, 'r') as f:
+                    combined_asts.append(json.load(f))
+            combined_input = json.dumps(merge_asts(combined_asts)) if combined_asts else ''
+            combined_key = hash_parts('combined', self.pandoc_version, combined_pdf_title, combined_pdf_author,
+                                      tenant.common_pdf_options, combined_input)
+
+        try:
+            self.convert_cached('combined_pdf', pandoc_cmd_combined, combined_input, combined_pdf_path, combined_key,
+                                input_key, tenant=tenant.name, mode=self.combined_mode)
+        except PolicyBuildError as e:
+            raise PolicyBuildError(f"Pandoc failed to create the combined PDF.\n{e}")
+
+    # --- Build ---
+    def prepare_pdf_format(self, tenant):
+        """Points the tenant's PDF runs at a precompiled preamble, or leaves them on the full one."""
+        tenant.pdf_format_options = []
+        if not self.precompile_preamble or not any(isinstance(b, PandocBackend) for b in self.backends):
+            return
+        # Tenants with the same PDF options share a format.
+        key = tuple(tenant.common_pdf_options)
+        if key not in self.pdf_formats:
+            with self.tracer.span('latex_format', tenant=tenant.name) as span:
+                options, message = prepare_format(tenant.common_pdf_options, self.pandoc_version)
+                span['precompiled'] = bool(options)
+            self.pdf_formats[key] = options
+            if options:
+                print(f"{tenant.label}PDF preamble: precompiled xelatex format ({message}).")
+            else:
+                print(f"{tenant.label}PDF preamble: loaded in full for every PDF ({message}).")
+        tenant.pdf_format_options = self.pdf_formats[key]
+
+    def submit_documents(self, tenants, scheduler, convert=True):
+        """Schedules every planned document of every tenant; returns a list of futures per tenant."""
+        tenant_futures = []
+        for tenant in tenants:
+            futures = []
+            for policy_filename, rendered_filename, rendered_title, history_table, _, rebuild in tenant.planned_jobs:
+                # Recorded up front so a combined manual can start as soon as its own documents are done.
+                tenant.processed_for_combined_pdf.append(tenant.output_paths(rendered_filename)[3])
+                if not rebuild:
+                    futures.append(None) # Up to date; reuse last build's output
+                    continue
+                print(f"{tenant.label}Processing: {policy_filename}  ->  Output: {rendered_filename}  (Title: {rendered_title})")
+                futures.append(scheduler.submit(f"document:{policy_filename}", self.process_policy, tenant,
+                                                policy_filename, rendered_filename, rendered_title, history_table,
+                                                convert))
+            tenant_futures.append(futures)
+        return tenant_futures
+
+    def collect_documents(self, tenants, tenant_futures):
+        """Waits for the documents and records the failed ones and the dependency graph."""
+        # Collect in submission order; a failure is recorded against its document
+        # and does not stop the remaining documents from being built.
+        for tenant, futures in zip(tenants, tenant_futures):
+            for (policy_filename, _, _, _, current_inputs, _), future in zip(tenant.planned_jobs, futures):
+                if future is None:
+                    continue
+                try:
+                    future.result()
+                    if current_inputs is not None:
+                        tenant.dependency_graph.update(policy_filename, current_inputs)
+                except Exception as e:
+                    # This will catch the 'template not found' error if the source file is wrong
+                    print(f"{tenant.label}ERROR processing {policy_filename}: {e}")
+                    tenant.failed_policies.append(policy_filename)
+
+            # Only successfully built documents are recorded, so failed ones are retried next time.
+            tenant.dependency_graph.save(keep={job[0] for job in tenant.planned_jobs})
+
+    def build_documents(self, tenants, scheduler, convert=True):
+        """Builds every planned document of every tenant on the shared scheduler."""
+        self.collect_documents(tenants, self.submit_documents(tenants, scheduler, convert))
+
+    def write_combined(self, tenant, backend, document_futures):
+        """Writes one backend's combined manual unless a document failed. Returns whether it was written."""
+        if any(future.exception() for future in document_futures if future is not None):
+            return False
+        backend.write_combined(tenant)
+        return True
+
+    def submit_combined(self, tenants, tenant_futures, scheduler):
+        """Schedules every backend's combined manual to start once the tenant's own documents are done."""
+        return [
+            (tenant, scheduler.submit(f"combined:{backend.name}:{tenant.name}", self.write_combined, tenant, backend,
+                                      futures, after=futures))
+            for tenant, futures in zip(tenants, tenant_futures) for backend in self.backends
+        ]
+
+    def collect_combined(self, tenants, combined_futures):
+        """Waits for the combined manuals. Returns the tenants that failed."""
+        failed = []
+        for tenant in tenants:
+            if tenant.failed_policies:
+                print(f"{tenant.label}ERROR: {len(tenant.failed_policies)} of {len(tenant.planned_jobs)} documents failed to build:")
+                for policy_filename in tenant.failed_policies:
+                    print(f"  - {policy_filename}")
+                print(f"{tenant.label}Skipping the combined manual because it would be incomplete.")
+                failed.append(tenant)
+
+        for tenant, future in combined_futures:
+            try:
+                future.result()
+            except Exception as e:
+                print(f"{tenant.label}ERROR: {e}")
+                if tenant not in failed:
+                    failed.append(tenant)
+        return failed
+
+    def build(self, tenants):
+        """Plans must already be made. Builds all documents and combined PDFs; returns the failed tenants."""
+        # All tenants share one scheduler, so a batch keeps every core busy.
+        rebuild_count = sum(1 for tenant in tenants for job in tenant.planned_jobs if job[5])
+        total_count = sum(len(tenant.planned_jobs) for tenant in tenants)
+        print(f"Building {rebuild_count} of {total_count} documents with {self.jobs} worker(s)...")
+        for tenant in tenants:
+            if any(job[5] for job in tenant.planned_jobs):
+                self.prepare_pdf_format(tenant)
+        with Scheduler(self.jobs, self.memory_budget_mb, self.job_costs) as scheduler:
+            tenant_futures = self.submit_documents(tenants, scheduler)
+            combined_futures = self.submit_combined(tenants, tenant_futures, scheduler)
+            self.collect_documents(tenants, tenant_futures)
+            failed = self.collect_combined(tenants, combined_futures)
+        for tenant in tenants:
+            if tenant not in failed:
+                self.write_manifest(tenant)
+        self.job_costs.save()
+        print(scheduler.summary())
+        self.report_cache()
+        return failed
+
+    def write_manifest(self, tenant):
+        """Writes <output>/manifest.json with the hash, size and source template of every artifact.
+
+        Documents that were not rebuilt keep the input_key of the last manifest
+        as long as their file has not changed.
+        """
+        manifest_path = os.path.join(tenant.output_dir, MANIFEST_FILE)
+        previous = {entry['path']: entry for entry in (load_manifest(manifest_path) or {}).get('artifacts', [])}
+        artifacts = []
+
+        def add(path, document, source):
+            if not os.path.exists(path):
+                return
+            entry = artifact_entry(tenant.output_dir, path, document, source, self.input_keys.get(path))
+            old = previous.get(entry['path'])
+            if 'input_key' not in entry and old and old.get('input_key') and old.get('sha256') == entry['sha256']:
+                entry['input_key'] = old['input_key']
+            artifacts.append(entry)
+
+        with self.tracer.span('manifest', tenant=tenant.name) as span:
+            for policy_filename, rendered_filename, _, _, _, _ in tenant.planned_jobs:
+                document = os.path.splitext(rendered_filename)[0]
+                paths = tenant.output_paths(rendered_filename)[:1]
+                paths += [path for backend in self.backends for path in backend.output_paths(tenant, rendered_filename)]
+                for path in paths:
+                    # The temp_combined/ files are inputs of the combined manual, not artifacts.
+                    if os.path.dirname(path) != tenant.dirs[3]:
+                        add(path, document, policy_filename)
+            for backend in self.backends:
+                combined_path = backend.combined_path(tenant)
+                add(combined_path, os.path.splitext(os.path.basename(combined_path))[0], None)
+            write_manifest({
+                'version': MANIFEST_VERSION,
+                'release_version': tenant.config.get('release_version'),
+                'commit': (self.history.current_build_commit or {}).get('hash') if self.history else None,
+                'artifacts': artifacts,
+            }, manifest_path)
+            span['artifacts'] = len(artifacts)
+        print(f"{tenant.label}Wrote {manifest_path} ({len(artifacts)} artifacts).")
+
+    def report_cache(self):
+        if self.build_cache.enabled:
+            evicted = self.build_cache.evict()
+            print(f"Build cache: {self.build_cache.hits} hit(s), {self.build_cache.misses} miss(es), {evicted} evicted.")
+            print(f"Pandoc AST cache: {self.ast_cache.hits} hit(s), {self.ast_cache.misses} parse(s).")
+        if self.remote_cache is not None:
+            print(self.remote_cache.summary())
+
+    # --- Watch Mode ---
+    def snapshot_sources(self):
+        """Returns {path: mtime_ns} for every file under policies/ and conf/."""
+        snapshot = {}
+        for folder in (self.policy_dir, 'conf'):
+            for root, _, files in os.walk(folder):
+                for name in files:
+                    path = os.path.join(root, name)
+                    try:
+                        snapshot[path] = os.stat(path).st_mtime_ns
+                    except OSError:
+                        continue
+        return snapshot
+
+    def run_watch_build(self, tenant, scheduler, convert):
+        """Re-plans the tenant and re-renders only the documents whose inputs changed."""
+        start = time.perf_counter()
+        tenant.reset()
+        self.plan_tenant(tenant, show_skipped=False, convert=convert)
+        self.build_documents([tenant], scheduler, convert=convert)
+        rebuilt = sum(1 for job in tenant.planned_jobs if job[5])
+        print(f"Rebuilt {rebuilt} document(s) in {time.perf_counter() - start:.2f}s. Waiting for changes...")
+
+    def watch(self, tenant, convert=False, interval=0.5):
+        """Rebuilds affected documents whenever files in policies/ or conf/ change.
+
+        The Jinja environment, policy order and config stay loaded between builds;
+        only the files that changed are read again. Jinja's auto_reload recompiles
+        an edited template on its next use. Runs until interrupted.
+        """
+        # Watch builds only live in memory, so a later full build still converts
+        # the PDFs and ODTs that watch mode skipped.
+        tenant.dependency_graph = DependencyGraph(None)
+        print(f"Watching {self.policy_dir}/ and conf/ for changes (Ctrl+C to stop)...")
+        # Watch builds skip most of the work, so their timings are not recorded.
+        with Scheduler(self.jobs, self.memory_budget_mb, JobCosts(None)) as scheduler:
+            previous = self.snapshot_sources()
+            self.run_watch_build(tenant, scheduler, convert)
+            while True:
+                time.sleep(interval)
+                current = self.snapshot_sources()
+                if current == previous:
+                    continue
+                # Debounce: an editor save often touches a file several times, so wait
+                # until the tree has stopped changing before rebuilding.
+                while True:
+                    time.sleep(interval)
+                    settled = self.snapshot_sources()
+                    if settled == current:
+                        break
+                    current = settled
+
+                changed = sorted(p for p in set(previous) | set(current) if previous.get(p) != current.get(p))
+                previous = current
+                print(f"\nChanged: {', '.join(changed)}")
+                try:
+                    if os.path.normpath(self.order_file) in changed:
+                        self.load_policy_order()
+                    if os.path.normpath(tenant.config_path) in changed:
+                        tenant.load_config()
+                except Exception as e:
+                    print(f"ERROR: {e}")
+                    continue
+                self.run_watch_build(tenant, scheduler, convert)
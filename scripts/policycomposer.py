@@ -0,0 +1,149 @@
+"""Importable API for building the policy documents in one process.
+
+    import sys; sys.path.insert(0, 'scripts')
+    import policycomposer
+
+    config = policycomposer.load_config('conf/config.yaml')
+    text = policycomposer.render_policy('byod_policy.md', config)
+    tenant = policycomposer.build(history='file')
+
+build() runs the same stages as get_git_history.py, validate_config.py and
+process_policies.py, but as a dependency graph in one process: the config,
+policy order and history are parsed once and handed from stage to stage.
+"""
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from config_deps import DEFAULT_GRAPH_FILE
+from config_loader import load_yaml
+from derived_context import derive_context
+from history_store import DEFAULT_RELEASE_PREFIX
+from git_history import (DEFAULT_HISTORY_FILE, DEFAULT_USERMAP_FILE, current_commit_from_env, export_history,
+                         load_usermap, write_history)
+from output_backends import OutputBackend, RenderedPolicy
+from policy_build import BASE_OUTPUT_DIR, CONFIG_PATH, Builder, PolicyBuildError, Tenant
+from validate_config import ConfigValidator
+
+__all__ = [
+    'Builder', 'OutputBackend', 'PolicyBuildError', 'RenderedPolicy', 'Tenant', 'build', 'derive_context',
+    'export_history', 'load_config', 'render_policy', 'run_stages', 'validate',
+]
+
+
+def load_config(config_path=CONFIG_PATH):
+    """Returns the parsed config."""
+    return load_yaml(config_path)
+
+
+def validate(config_path=CONFIG_PATH, config=None):
+    """Runs every ConfigValidator check and returns the validator with its warnings and errors."""
+    validator = ConfigValidator(config_path, config=config)
+    validator.validate()
+    return validator
+
+
+def render_policy(policy_filename, config, builder=None):
+    """Renders one policy template with a config dict and returns the Markdown."""
+    builder = builder or Builder()
+    return builder.render_policy(policy_filename, derive_context(config))
+
+
+def run_stages(stages, max_workers=None):
+    """Runs (name, dependencies, func) stages as a DAG.
+
+    A stage starts as soon as all its dependencies have finished, so independent
+    stages run at the same time. If a stage raises, the stages that depend on it
+    are skipped and PolicyBuildError is raised once the running ones finish.
+    Returns {name: result}.
+    """
+    pending = {name: (set(deps), func) for name, deps, func in stages}
+    unknown = {dep for deps, _ in pending.values() for dep in deps} - set(pending)
+    if unknown:
+        raise ValueError(f"Unknown stage dependencies: {', '.join(sorted(unknown))}")
+    results = {}
+    failures = {}
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers or len(pending) or 1) as executor:
+        while pending or running:
+            for name, (deps, func) in list(pending.items()):
+                if deps & set(failures):
+                    del pending[name]
+                    failures[name] = None # Skipped because a dependency failed
+                elif deps <= set(results):
+                    del pending[name]
+                    running[executor.submit(func)] = name
+            if not running:
+                if pending:
+                    raise ValueError(f"Stage dependency cycle: {', '.join(sorted(pending))}")
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    failures[name] = e
+    errors = [f"{name}: {e}" for name, e in failures.items() if e is not None]
+    if errors:
+        raise PolicyBuildError("Build stage failed:\n" + '\n'.join(errors))
+    return results
+
+
+def build(config_path=CONFIG_PATH, history='file', history_mode='per-file', check_config=True,
+          output_dir=BASE_OUTPUT_DIR, graph_file=DEFAULT_GRAPH_FILE, plan_only=False, builder=None,
+          **builder_options):
+    """Builds every document for one config in this process and returns its Tenant.
+
+    history is 'git' (export it from the repository, using the CURRENT_COMMIT_*
+    environment variables like get_git_history.py, and also write
+    build/git_history.sqlite), 'file' (read build/git_history.sqlite) or 'none'.
+    With check_config, validation errors stop the build before any document is
+    converted. builder_options are passed to Builder (jobs, no_cache, ...).
+    Raises PolicyBuildError if a stage or a document fails.
+    """
+    builder = builder or Builder(**builder_options)
+    state = {}
+
+    def load_tenant():
+        state['tenant'] = builder.create_tenant('', config_path, output_dir, graph_file)
+
+    def load_history():
+        if history == 'git':
+            usermap = load_usermap(DEFAULT_USERMAP_FILE)
+            current_commit, is_global_release = current_commit_from_env(usermap)
+            history_data = export_history(builder.policy_files, usermap, current_commit, is_global_release,
+                                          mode=history_mode, policy_dir=builder.policy_dir, tracer=builder.tracer)
+            release_prefix = state['tenant'].config.get('release_commit_prefix', DEFAULT_RELEASE_PREFIX)
+            write_history(history_data, DEFAULT_HISTORY_FILE, release_prefix, tracer=builder.tracer)
+            builder.load_history(DEFAULT_HISTORY_FILE)
+        elif history == 'file':
+            builder.load_history(DEFAULT_HISTORY_FILE)
+
+    def check():
+        if not check_config:
+            return
+        validator = validate(config_path, config=state['tenant'].config)
+        if validator.warnings:
+            print(f"Config validation: {len(validator.warnings)} warning(s). Run scripts/validate_config.py to see them.")
+        if validator.errors:
+            raise PolicyBuildError("Config validation failed:\n" + '\n'.join(f"  - {e}" for e in validator.errors))
+
+    def plan():
+        builder.plan_tenant(state['tenant'])
+
+    def documents():
+        if plan_only:
+            return
+        tenant = state['tenant']
+        failed = builder.build([tenant])
+        if failed:
+            raise PolicyBuildError(f"{len(tenant.failed_policies)} document(s) failed: {', '.join(tenant.failed_policies)}"
+                                   if tenant.failed_policies else "The combined manual failed to build.")
+
+    run_stages([
+        ('policy_order', [], builder.load_policy_order),
+        ('config', [], load_tenant),
+        ('history', ['policy_order', 'config'], load_history),
+        ('validate', ['config'], check),
+        ('plan', ['policy_order', 'config', 'history'], plan),
+        ('documents', ['plan', 'validate'], documents),
+    ])
+    return state['tenant']
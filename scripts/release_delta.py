@@ -0,0 +1,61 @@
+import argparse
+import os
+import shutil
+from release_manifest import MANIFEST_FILE, load_manifest, release_delta, write_manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Collect the artifacts that changed since the previous release, plus the release manifest.")
+    parser.add_argument('--tag', required=True, help="Tag of the release being published.")
+    parser.add_argument('--output-dir', default='output',
+                        help="Build output directory with manifest.json (default: %(default)s).")
+    parser.add_argument('--previous', metavar='MANIFEST',
+                        help="manifest.json of the previous release. Without it, every artifact is published.")
+    parser.add_argument('--dest', default='release_assets',
+                        help="Directory to copy the changed artifacts and the release manifest to (default: %(default)s).")
+    args = parser.parse_args()
+
+    manifest_path = os.path.join(args.output_dir, MANIFEST_FILE)
+    manifest = load_manifest(manifest_path)
+    if manifest is None:
+        print(f"ERROR: No build manifest at {manifest_path}. Run process_policies.py first.")
+        exit(1)
+
+    previous = None
+    if args.previous:
+        previous = load_manifest(args.previous)
+        if previous is None:
+            print(f"WARNING: Could not read the previous release manifest {args.previous}; publishing every artifact.")
+    else:
+        print("No previous release manifest; publishing every artifact.")
+
+    release_manifest, changed, removed = release_delta(manifest, previous, args.tag)
+
+    # Release assets are a flat list of files, so every uploaded name has to be unique.
+    names = {}
+    for entry in changed:
+        name = os.path.basename(entry['path'])
+        if name in names:
+            print(f"ERROR: {entry['path']} and {names[name]} would both be uploaded as {name}.")
+            exit(1)
+        names[name] = entry['path']
+
+    if os.path.isdir(args.dest):
+        shutil.rmtree(args.dest)
+    os.makedirs(args.dest)
+    for entry in changed:
+        shutil.copyfile(os.path.join(args.output_dir, entry['path']), os.path.join(args.dest, os.path.basename(entry['path'])))
+    write_manifest(release_manifest, os.path.join(args.dest, MANIFEST_FILE))
+
+    since = f" since {previous.get('release')}" if previous else ""
+    print(f"{len(changed)} of {len(manifest['artifacts'])} artifact(s) changed{since}; {len(removed)} removed.")
+    for entry in changed:
+        print(f"  + {entry['path']}")
+    for path in removed:
+        print(f"  - {path}")
+    print(f"Release assets written to {args.dest}/.")
+
+
+if __name__ == "__main__":
+    main()
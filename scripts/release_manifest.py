@@ -0,0 +1,111 @@
+"""The content manifest of a build's output directory, and release deltas between manifests.
+
+process_policies.py writes output/manifest.json after every successful build:
+
+    {"version": 1, "release_version": "1.4", "artifacts": [
+        {"path": "pdf/byod_policy.pdf", "format": "pdf", "document": "byod_policy",
+         "source": "byod_policy.md", "sha256": "...", "size": 48211, "input_key": "..."}, ...]}
+
+input_key is a hash of everything the artifact was built from (see
+manifest_key()), except the row a global release adds to every history table.
+PDFs are not byte-for-byte reproducible (xelatex stamps the build time into
+them), and a global release stamps every document, so two artifacts with the
+same input_key count as unchanged even when their sha256 differs. A release
+with no policy or config edits therefore publishes no new artifacts.
+
+A release manifest (see release_delta.py) adds to each artifact the release it
+was last published in, so a consumer can fetch every current file while each
+release only carries the files that changed.
+"""
+import json
+import os
+from build_cache import hash_file, hash_parts
+
+MANIFEST_FILE = 'manifest.json'
+MANIFEST_VERSION = 1
+
+
+def manifest_key(kind, inputs_key, show_history, *settings):
+    """Returns the input_key of an artifact of one kind built from an inputs key.
+
+    inputs_key hashes the content the artifact shows, with its history table
+    as it would be without a global release. show_history is whether the
+    artifact shows that table; settings are the tool versions and options
+    that also shape it.
+    """
+    return hash_parts(kind, inputs_key, 'history' if show_history else '', *settings)
+
+
+def artifact_entry(output_dir, path, document, source, input_key=None):
+    entry = {
+        'path': os.path.relpath(path, output_dir).replace(os.sep, '/'),
+        'format': os.path.splitext(path)[1].lstrip('.'),
+        'document': document,
+        'source': source,
+        'sha256': hash_file(path),
+        'size': os.path.getsize(path),
+    }
+    if input_key:
+        entry['input_key'] = input_key
+    return entry
+
+
+def load_manifest(path):
+    """Returns the manifest at path, or None if it does not exist or cannot be read."""
+    try:
+        with open(path, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(manifest, dict) or manifest.get('version') != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def write_manifest(manifest, path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+        f.write('\n')
+    os.replace(tmp_path, path)
+
+
+def is_unchanged(entry, previous):
+    """True if an artifact has the same content, or was built from the same inputs, as a previous entry."""
+    if previous is None:
+        return False
+    if entry['sha256'] == previous.get('sha256'):
+        return True
+    return bool(entry.get('input_key')) and entry.get('input_key') == previous.get('input_key')
+
+
+def release_delta(manifest, previous, release_tag):
+    """Compares a build manifest with the previous release manifest.
+
+    Returns (release_manifest, changed, removed): the manifest to publish, the
+    artifacts to upload with this release and the paths that were dropped.
+    An unchanged artifact keeps the entry, and so the release, it was
+    published with; its file is not uploaded again.
+    """
+    previous_artifacts = {entry['path']: entry for entry in (previous or {}).get('artifacts', [])}
+    artifacts = []
+    changed = []
+    for entry in manifest['artifacts']:
+        old = previous_artifacts.get(entry['path'])
+        if is_unchanged(entry, old) and old.get('release'):
+            artifacts.append({**old, 'document': entry['document'], 'source': entry['source']})
+        else:
+            entry = {**entry, 'release': release_tag}
+            artifacts.append(entry)
+            changed.append(entry)
+    current_paths = {entry['path'] for entry in manifest['artifacts']}
+    removed = sorted(path for path in previous_artifacts if path not in current_paths)
+    release_manifest = {
+        **manifest,
+        'release': release_tag,
+        'previous_release': (previous or {}).get('release'),
+        'artifacts': artifacts,
+        'removed': removed,
+    }
+    return release_manifest, changed, removed
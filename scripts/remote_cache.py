@@ -0,0 +1,164 @@
+import os
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+
+REMOTE_CACHE_ENV = 'POLICY_REMOTE_CACHE'
+REMOTE_CACHE_TOKEN_ENV = 'POLICY_REMOTE_CACHE_TOKEN'
+
+
+class RemoteCache:
+    """A content-addressed artifact store shared between machines.
+
+    Entries are named by the build cache key plus the file suffix, e.g.
+    '3fa9...c2.pdf', and never change once written, so backends need no
+    locking or invalidation. Subclasses implement _get() and _put(); errors
+    count as misses so an unreachable cache never fails the build.
+    """
+    description = 'remote'
+
+    def __init__(self, read_only=False):
+        self.read_only = read_only
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.bytes_downloaded = 0
+        self.bytes_uploaded = 0
+        self.uploads = 0
+        self.offline = False # Set when the backend is unreachable; later lookups are skipped
+        self.lock = threading.Lock()
+
+    def get(self, name):
+        """Returns the bytes stored under name, or None."""
+        data = None
+        if not self.offline:
+            try:
+                data = self._get(name)
+            except Exception as e:
+                self._error('read', name, e)
+        with self.lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.bytes_downloaded += len(data)
+        return data
+
+    def put(self, name, data):
+        if self.read_only or self.offline:
+            return
+        try:
+            self._put(name, data)
+        except Exception as e:
+            self._error('write', name, e)
+            return
+        with self.lock:
+            self.uploads += 1
+            self.bytes_uploaded += len(data)
+
+    def _error(self, action, name, e):
+        with self.lock:
+            self.errors += 1
+            first = self.errors == 1
+        if first: # One warning per build is enough; the summary has the count.
+            print(f"  WARNING: Could not {action} {name} in the remote cache ({self.description}): {e}")
+
+    def summary(self):
+        return (f"Remote cache ({self.description}): {self.hits} hit(s), {self.misses} miss(es), "
+                f"{self.bytes_downloaded / 1024:.0f} KB downloaded, {self.uploads} upload(s), "
+                f"{self.bytes_uploaded / 1024:.0f} KB uploaded"
+                + (f", {self.errors} error(s)" if self.errors else "")
+                + (" (unreachable, skipped after the first error)" if self.offline else "") + ".")
+
+    def _get(self, name):
+        raise NotImplementedError
+
+    def _put(self, name, data):
+        raise NotImplementedError
+
+
+class DirectoryRemoteCache(RemoteCache):
+    """A directory, e.g. on a network share or restored by the CI's cache step."""
+
+    def __init__(self, path, read_only=False):
+        super().__init__(read_only)
+        self.path = path
+        self.description = path
+
+    def _entry_path(self, name):
+        return os.path.join(self.path, name[:2], name)
+
+    def _get(self, name):
+        try:
+            with open(self._entry_path(name), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _put(self, name, data):
+        entry = self._entry_path(name)
+        if os.path.exists(entry):
+            return
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        # Other runners may write the same entry at the same time; rename is atomic.
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(entry), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, entry)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+class HttpRemoteCache(RemoteCache):
+    """A plain HTTP store: GET <url>/<name> returns the entry or 404, PUT <url>/<name> stores it.
+
+    This is the protocol of nginx/Apache WebDAV, bazel-remote and most object
+    store gateways; scripts/cache_server.py is a local stand-in for testing.
+    """
+
+    def __init__(self, url, token=None, timeout=10, read_only=False):
+        super().__init__(read_only)
+        self.url = url.rstrip('/')
+        self.description = self.url
+        self.headers = {'Authorization': f"Bearer {token}"} if token else {}
+        self.timeout = timeout
+
+    def _request(self, method, name, data=None):
+        request = urllib.request.Request(f"{self.url}/{name}", data=data, method=method, headers=self.headers)
+        try:
+            return urllib.request.urlopen(request, timeout=self.timeout)
+        except urllib.error.HTTPError:
+            raise
+        except OSError:
+            # Connection refused or timed out: don't wait on every remaining entry.
+            self.offline = True
+            raise
+
+    def _get(self, name):
+        try:
+            with self._request('GET', name) as response:
+                return response.read()
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return None
+            raise
+
+    def _put(self, name, data):
+        with self._request('PUT', name, data) as response:
+            response.read()
+
+
+def open_remote_cache(spec, read_only=False, environ=os.environ):
+    """Returns a RemoteCache for an http(s):// URL or a directory path, or None if spec is empty."""
+    if not spec:
+        return None
+    if spec.startswith(('http://', 'https://')):
+        return HttpRemoteCache(spec, token=environ.get(REMOTE_CACHE_TOKEN_ENV), read_only=read_only)
+    if spec.startswith('file://'):
+        spec = spec[len('file://'):]
+    return DirectoryRemoteCache(spec, read_only=read_only)
+
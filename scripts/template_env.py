@@ -0,0 +1,43 @@
+import functools
+import os
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+DEFAULT_TEMPLATE_CACHE_DIR = os.path.join('build', 'jinja_cache')
+
+
+def create_policy_environment(policy_dir, cache_dir=DEFAULT_TEMPLATE_CACHE_DIR, use_cache=True):
+    """Returns the Jinja2 environment used to render the policy templates.
+
+    With use_cache, compiled templates are kept in a FileSystemBytecodeCache.
+    Jinja checks each entry against a checksum of the template source, so an
+    edited policy is recompiled and every other one is loaded without parsing.
+    """
+    bytecode_cache = None
+    if use_cache:
+        os.makedirs(cache_dir, exist_ok=True)
+        bytecode_cache = FileSystemBytecodeCache(cache_dir)
+    return Environment(loader=FileSystemLoader(policy_dir), bytecode_cache=bytecode_cache)
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_inline(source):
+    """Compiles a short template string, such as an output filename or title from policy_order.yaml.
+
+    The same strings are rendered for every build and every config, so each one
+    is compiled only once per process.
+    """
+    return Environment().from_string(source)
+
+
+def precompile_templates(env):
+    """Loads every policy template once so the bytecode cache is filled.
+
+    Returns a list of (template_name, error) for templates that failed to compile.
+    """
+    failures = []
+    for name in env.list_templates(extensions=['md']):
+        try:
+            env.get_template(name)
+        except Exception as e:
+            failures.append((name, e))
+    return failures
@@ -1,33 +1,171 @@
 import os
 import argparse
 import sys
-import os
 from pathlib import Path
-import yaml
-from jinja2 import Environment, meta
+import hashlib
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from jinja2 import Environment
+from build_cache import hash_file
+from config_loader import load_yaml
+from config_deps import ConfigIndex, find_config_paths, find_guarded_paths, fingerprint
+from derived_context import derive_context, derive_ephi_access
 
 CONFIG_DEFAULT_PATH = 'conf/config.yaml'
 SCHEMA_DEFAULT_PATH = 'conf/ui_schema.yaml'
 POLICY_DIR = 'policies'
+VALIDATOR_CACHE_PATH = os.path.join('build', 'validate_cache.json')
+VALIDATOR_CACHE_VERSION = 1
+# Parsing takes about 5 ms per template and a spawned worker about a second to
+# start, so worker processes only pay off for large batches.
+PARALLEL_PARSE_THRESHOLD = 300
+
+
+def parse_template_source(source):
+    """Parses a template and returns the config paths it reads, as stored in the validator cache."""
+    try:
+        ast = Environment().parse(source)
+    except Exception as e:
+        return {'error': str(e)}
+    return {'paths': find_config_paths(ast), 'guarded': sorted(find_guarded_paths(ast))}
+
+
+def scan_templates(policy_files, cache=None, jobs=None):
+    """Returns {file: parse_result} for every template, in the order given.
+
+    Templates whose content hash matches the cache are not parsed again. With
+    jobs > 1 and many templates to parse, they are parsed in worker processes;
+    jobs=None parses in this process, which is what library callers get, as
+    they may be running other threads.
+    """
+    sources = {}
+    results = {}
+    for policy_file in policy_files:
+        source = Path(policy_file).read_text()
+        digest = hashlib.sha256(source.encode('utf-8')).hexdigest()
+        entry = cache.template(str(policy_file), digest) if cache else None
+        if entry is not None:
+            results[str(policy_file)] = entry
+        else:
+            sources[str(policy_file)] = (digest, source)
+
+    names = list(sources)
+    texts = [sources[name][1] for name in names]
+    if jobs and jobs > 1 and len(names) >= PARALLEL_PARSE_THRESHOLD:
+        # Spawned, not forked: forking a process with running threads can deadlock the child.
+        with ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context('spawn')) as executor:
+            parsed = list(executor.map(parse_template_source, texts, chunksize=4))
+    else:
+        parsed = [parse_template_source(text) for text in texts]
+    for name, entry in zip(names, parsed):
+        entry['hash'] = sources[name][0]
+        results[name] = entry
+        if cache:
+            cache.update_template(name, entry)
+    return {str(f): results[str(f)] for f in policy_files}
+
+
+class ValidatorCache:
+    """Remembers template parse results and check findings between runs.
+
+    Used by --changed-only. Templates are keyed by content hash, and each check
+    by a fingerprint of the inputs it reads, so a check whose inputs did not
+    change replays its previous warnings and errors.
+    """
+
+    def __init__(self, path=VALIDATOR_CACHE_PATH):
+        self.path = path
+        self.templates = {}
+        self.checks = {}
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+            if data.get('version') == VALIDATOR_CACHE_VERSION:
+                self.templates = data.get('templates', {})
+                self.checks = data.get('checks', {})
+        except (OSError, ValueError):
+            pass
+
+    def template(self, name, digest):
+        entry = self.templates.get(name)
+        if entry and entry.get('hash') == digest:
+            return entry
+        return None
+
+    def update_template(self, name, entry):
+        self.templates[name] = entry
+
+    def findings(self, check_name, key):
+        """Returns the (warnings, errors) recorded for unchanged inputs, or None."""
+        entry = self.checks.get(check_name)
+        if entry and entry.get('key') == key:
+            return entry['warnings'], entry['errors']
+        return None
+
+    def record(self, check_name, key, warnings, errors):
+        self.checks[check_name] = {'key': key, 'warnings': warnings, 'errors': errors}
+
+    def save(self, keep_templates=None):
+        """Writes the cache, dropping templates that are no longer in `keep_templates`."""
+        if keep_templates is not None:
+            self.templates = {k: v for k, v in self.templates.items() if k in keep_templates}
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': VALIDATOR_CACHE_VERSION, 'templates': self.templates, 'checks': self.checks}, f)
+        os.replace(tmp_path, self.path)
 
 class ConfigValidator:
-    def __init__(self, config_path):
+    def __init__(self, config_path, cache=None, jobs=None, config=None):
+        """config, if given, is an already parsed copy of config_path (e.g. shared with the build)."""
         self.config_path = config_path
+        self.cache = cache
+        self.jobs = jobs
         self.warnings = []
         self.errors = []
-        try:
-            with open(config_path, 'r') as f:
-                self.config = yaml.safe_load(f)
-        except Exception as e:
-            self.errors.append(f"Fatal: Could not read or parse YAML file at {config_path}: {e}")
-            self.config = None
-        
-        try:
-            with open(SCHEMA_DEFAULT_PATH, 'r') as f:
-                self.schema = yaml.safe_load(f)
-        except Exception as e:
-            self.warnings.append(f"Could not read or parse UI Schema file at {SCHEMA_DEFAULT_PATH}. UI validation will be skipped.")
-            self.schema = None
+        self.config = config
+        if self.config is None:
+            try:
+                self.config = load_yaml(config_path)
+            except Exception as e:
+                self.errors.append(f"Fatal: Could not read or parse YAML file at {config_path}: {e}")
+        self._config_index = None
+        self._context_index = None
+        self._schema_loaded = False
+        self._schema = None
+        self._policy_files = None
+
+    @property
+    def schema(self):
+        """The UI schema, read on first use so an unchanged schema is never loaded with --changed-only."""
+        if not self._schema_loaded:
+            self._schema_loaded = True
+            try:
+                self._schema = load_yaml(SCHEMA_DEFAULT_PATH)
+            except Exception as e:
+                self.warnings.append(f"Could not read or parse UI Schema file at {SCHEMA_DEFAULT_PATH}. UI validation will be skipped.")
+        return self._schema
+
+    @property
+    def policy_files(self):
+        if self._policy_files is None:
+            self._policy_files = sorted(Path(POLICY_DIR).rglob('*.md')) # Sort for consistent error reporting
+        return self._policy_files
+
+    @property
+    def config_index(self):
+        """The dotted-path index of the config, built on first use."""
+        if self._config_index is None:
+            self._config_index = ConfigIndex(self.config)
+        return self._config_index
+
+    @property
+    def context_index(self):
+        """Index of what the templates can read: the config plus derive_context()'s indexes."""
+        if self._context_index is None:
+            self._context_index = ConfigIndex(derive_context(self.config))
+        return self._context_index
 
     def add_error(self, message):
         self.errors.append(message)
@@ -40,15 +178,54 @@ class ConfigValidator:
             return
 
         print("--- Running All Validation Checks ---")
-        self.check_required_keys()
-        self.check_ephi_consistency()
-        self.check_vendor_structure()
-        self.check_review_committee()
-        self.check_compliance_frameworks_structure()
-        self.check_jinja_variables()
+        for name, check, inputs in self.checks():
+            if self.cache is None:
+                check()
+                continue
+            key = fingerprint(inputs())
+            cached = self.cache.findings(name, key)
+            if cached is not None:
+                print(f"-  {name}: inputs unchanged, reusing previous result.")
+                self.warnings.extend(cached[0])
+                self.errors.extend(cached[1])
+                continue
+            warnings_before, errors_before = len(self.warnings), len(self.errors)
+            check()
+            self.cache.record(name, key, self.warnings[warnings_before:], self.errors[errors_before:])
+        if self.cache is not None:
+            self.cache.save(keep_templates={str(f) for f in self.policy_files})
+        print("--- Validation Complete ---")
+
+    def checks(self):
+        """Returns (name, check, inputs) for every check, in order.
+
+        inputs() returns everything the check reads, so --changed-only can skip
+        a check whose inputs have the same fingerprint as in the previous run.
+        """
+        config = self.config
+        return [
+            ('required_keys', self.check_required_keys,
+             lambda: [[k, type(config.get(k)).__name__, k in config] for k in ('company_name', 'release_version', 'vendors', 'compliance_frameworks', 'service_types')]),
+            ('ephi_consistency', self.check_ephi_consistency,
+             lambda: [config.get('ephi_access', False), config.get('service_types', {})]),
+            ('vendor_structure', self.check_vendor_structure,
+             lambda: config.get('vendors', [])),
+            ('review_committee', self.check_review_committee,
+             lambda: [config.get('show_review_committee'), bool(config.get('review_committee'))]),
+            ('compliance_frameworks', self.check_compliance_frameworks_structure,
+             lambda: config.get('compliance_frameworks', {})),
+            ('jinja_variables', self.check_jinja_variables,
+             lambda: [self._index_fingerprint(self.context_index), [[str(f), hash_file(str(f))] for f in self.policy_files]]),
+            ('ui_schema', self._check_ui_schema_if_present,
+             lambda: [self._index_fingerprint(self.config_index), hash_file(SCHEMA_DEFAULT_PATH)]),
+        ]
+
+    def _index_fingerprint(self, index):
+        return [sorted(index.paths), sorted(index.leaves)]
+
+    def _check_ui_schema_if_present(self):
         if self.schema:
             self.check_ui_schema()
-        print("--- Validation Complete ---")
 
     def check_required_keys(self):
         """Checks for presence and basic types of essential keys."""
@@ -68,17 +245,11 @@ class ConfigValidator:
         print("2. Checking ePHI flag consistency...")
         canonical_ephi_access = self.config.get('ephi_access', False)
         
-        derived_ephi_access = False
-        service_types = self.config.get('service_types', {})
-        if not isinstance(service_types, dict):
+        if not isinstance(self.config.get('service_types', {}), dict):
             self.add_error("'service_types' should be a dictionary.")
             return
 
-        for service, details in service_types.items():
-            if isinstance(details, dict) and details.get('enabled') and details.get('phi_access'):
-                derived_ephi_access = True
-                break
-        
+        derived_ephi_access = derive_ephi_access(self.config)
         if canonical_ephi_access != derived_ephi_access:
             self.add_error(
                 f"Mismatch found: The main 'ephi_access' is '{canonical_ephi_access}', "
@@ -146,27 +317,28 @@ class ConfigValidator:
         """Parses all policy templates and checks if used variables exist in the config."""
         print("6. Checking for undefined Jinja2 variables in policy templates...")
         env = Environment()
-        policy_files = Path(POLICY_DIR).rglob('*.md')
-        
-        # Store variables found per file
-        template_vars_per_file = {}
+        parsed = scan_templates(self.policy_files, cache=self.cache, jobs=self.jobs)
 
-        for policy_file in sorted(policy_files): # Sort for consistent error reporting
-            try:
-                template_source = policy_file.read_text()
-                ast = env.parse(template_source)
-                template_vars = meta.find_undeclared_variables(ast)
-                if template_vars:
-                    template_vars_per_file[str(policy_file)] = template_vars
-            except Exception as e:
-                self.add_warning(f"Could not parse template {policy_file}: {e}")
-        # Flatten the config dict for easy checking of nested keys
-        config_keys = self._flatten_dict(self.config)
+        for policy_file, entry in parsed.items():
+            if 'error' in entry:
+                self.add_warning(f"Could not parse template {policy_file}: {entry['error']}")
+                continue
+            guarded = set(entry['guarded'])
+            reported = set()
+            for path, lineno in sorted(entry['paths'].items(), key=lambda item: item[1]):
+                if path.split('.')[0] in env.globals or path in guarded:
+                    continue
+                missing = self.context_index.missing_prefix(path)
+                # Report 'a.b' once even if the template reads a.b.c and a.b.d.
+                if missing and missing not in reported:
+                    reported.add(missing)
+                    detail = f"'{path}' is not defined" if missing == path else f"'{path}' is used but '{missing}' is not defined"
+                    self.add_warning(f"{policy_file}:{lineno}: {detail} in the config. It will render as blank.")
 
     def check_ui_schema(self):
         """Validates the ui_schema.yaml against the config.yaml."""
         print("7. Checking UI Schema against config...")
-        config_keys = self._flatten_dict(self.config)
+        config_keys = self.config_index
         schema_keys = self._flatten_schema(self.schema)
         
         # Check that every key in the schema exists in the config
@@ -213,34 +385,12 @@ class ConfigValidator:
                     keys.update(self._flatten_schema(value))
         return keys
 
-    def _flatten_dict(self, d, parent_key='', sep='.'):
-        """Flattens a nested dictionary for easy key lookup."""
-        items = []
-        for k, v in d.items():
-            new_key = parent_key + sep + k if parent_key else k
-            if isinstance(v, dict):
-                # Add the dictionary key itself (e.g., 'service_types.saas')
-                items.append((new_key, v)) 
-                items.extend(self._flatten_dict(v, new_key, sep=sep).items()) # Recurse
-            else:
-                items.append((new_key, v))
-        # Also add the top-level keys themselves for checks like {% if service_types.saas %}
-        for k in d.keys():
-            if isinstance(d[k], dict):
-                items.append((k, d[k]))
-        return dict(items)
     def fix_ephi_access(self):
         """Automatically updates the canonical ephi_access flag."""
         if not self.config:
             return False
         
-        derived_ephi_access = False
-        service_types = self.config.get('service_types', {})
-        for service, details in service_types.items():
-            if isinstance(details, dict) and details.get('enabled') and details.get('phi_access'):
-                derived_ephi_access = True
-                break
-        
+        derived_ephi_access = derive_ephi_access(self.config)
         if self.config.get('ephi_access') != derived_ephi_access:
             print(f"Fixing 'ephi_access' flag to '{derived_ephi_access}'...")
             # We need to re-read and write using a YAML library that preserves comments and structure
@@ -264,18 +414,22 @@ def main():
     parser = argparse.ArgumentParser(description="Validate the PolicyComposer config.yaml file.")
     parser.add_argument('--config', default=CONFIG_DEFAULT_PATH, help=f"Path to the config file (default: {CONFIG_DEFAULT_PATH})")
     parser.add_argument('--fix', action='store_true', help="Automatically fix the canonical 'ephi_access' flag if a mismatch is found.")
+    parser.add_argument('--changed-only', action='store_true', help="Reuse results for unchanged templates and config sections from the cache file (for pre-commit hooks).")
+    parser.add_argument('--cache-file', default=VALIDATOR_CACHE_PATH, help=f"Cache file used by --changed-only (default: {VALIDATOR_CACHE_PATH})")
+    parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count() or 1, help="Worker processes for parsing changed templates (default: number of CPUs).")
     args = parser.parse_args()
 
     if not os.path.exists(args.config):
         print(f"Error: Config file not found at '{args.config}'", file=sys.stderr)
         sys.exit(2)
 
-    validator = ConfigValidator(args.config)
+    cache = ValidatorCache(args.cache_file) if args.changed_only else None
+    validator = ConfigValidator(args.config, cache=cache, jobs=args.jobs)
     if args.fix:
         validator.fix_ephi_access()
         # Re-run validation after fixing
         print("\nRe-running validation after applying fix...")
-        validator = ConfigValidator(args.config)
+        validator = ConfigValidator(args.config, cache=cache, jobs=args.jobs)
     validator.validate()
     if validator.warnings:
         print("\n--- ⚠️ Warnings ---")
@@ -293,222 +447,3 @@ def main():
 
 if __name__ == "__main__":
     main()
-from jinja2 import Environment, FileSystemLoader, Template
-import subprocess
-import json
-
-# --- 1. Setup ---
-print("Starting policy build process...")
-config_path = 'conf/config.yaml'
-policy_dir = 'policies'
-order_file = 'conf/policy_order.yaml' 
-history_file = 'build/git_history.json'
-
-# Output directories
-md_output_dir = 'md'
-pdf_output_dir = 'pdf'
-temp_combined_dir = 'temp_combined'
-
-os.makedirs(md_output_dir, exist_ok=True)
-os.makedirs(pdf_output_dir, exist_ok=True)
-os.makedirs(temp_combined_dir, exist_ok=True)
-
-# --- 2. Load Config & History ---
-print(f"Loading config from {config_path}")
-with open(config_path, 'r') as f:
-    config = yaml.safe_load(f)
-
-# Load the policy order config
-print(f"Loading policy order from {order_file}")
-try:
-    with open(order_file, 'r') as f:
-        policy_order_config = yaml.safe_load(f)
-    POLICY_FILES_LIST = policy_order_config.get('policy_files', [])
-except Exception as e:
-    print(f"ERROR: Could not load or parse {order_file}: {e}")
-    exit(1)
-
-print(f"Loading history from {history_file}")
-try:
-    with open(history_file, 'r') as f:
-        history_data = json.load(f)
-    CURRENT_BUILD_COMMIT = history_data.get('current_build_commit')
-    FILE_HISTORY = history_data.get('file_history', {})
-    IS_GLOBAL_RELEASE = history_data.get('is_global_release', False)
-except Exception as e:
-    print(f"Could not load history file: {e}")
-    CURRENT_BUILD_COMMIT = None
-    FILE_HISTORY = {}
-    IS_GLOBAL_RELEASE = False
-
-# --- 3. Setup Jinja2 ---
-env = Environment(loader=FileSystemLoader(policy_dir))
-processed_for_combined_pdf = []
-
-# --- Helper Function to Generate History Table ---
-def get_history_table(policy_filename):
-    # 1. Get the list of commits that *only* touched this file
-    commits = FILE_HISTORY.get(policy_filename, [])
-    
-    if not CURRENT_BUILD_COMMIT:
-        return "" # Can't build history if build commit info is missing
-
-    # 2. Check if this is a global release
-    if IS_GLOBAL_RELEASE:
-        print(f"  -> Global release detected. Stamping with commit {CURRENT_BUILD_COMMIT['hash'][:7]}")
-        # For a global release, we *only* show the global release commit.
-        # We also check if the global commit is *already* in the file history (if the config was the *only* thing committed)
-        # This logic ensures the global commit is added, and it's the *only* one if it's a global release.
-        
-        # Check if the global commit is already in the file's history
-        found_in_history = False
-        for commit in commits:
-             if commit['hash'] == CURRENT_BUILD_COMMIT['hash']:
-                found_in_history = True
-                break
-        
-        # If the global commit wasn't in the file's history, add it.
-        # This is the key logic for stamping config-only changes.
-        if not found_in_history:
-             commits.insert(0, CURRENT_BUILD_COMMIT)
-             
-        # Now, filter *only* for the global release commit
-        commits = [c for c in commits if c['hash'] == CURRENT_BUILD_COMMIT['hash']]
-
-    else:
-        # 3. Not a global release, so filter by the commit prefix
-        prefix = config.get('release_commit_prefix', 'RELEASE:')
-        commits = [c for c in commits if c['subject'].startswith(prefix)]
-
-    # 4. Build the markdown table
-    if not commits:
-        return "" # No history to show
-
-    table = "\n\n## Version History\n\n"
-    table += "| Date | Updated By | Commit | Comments |\n"
-    table += "| :--- | :--- | :--- | :--- |\n"
-    
-    for commit in commits:
-        hash_short = commit['hash'][:7]
-        # We'd need the repo URL from config to make this a link
-        table += f"| {commit['date']} | {commit['author_name']} | {hash_short} | {commit['subject']} |\n"
-        
-    return table
-
-# --- 4. Process Each Policy File ---
-print(f"Processing {len(POLICY_FILES_LIST)} policy files from {order_file}...")
-
-# --- Get PDF Font settings from config ---
-pdf_font = config.get('pdf_main_font', 'Noto Sans')
-pdf_header_font = config.get('pdf_header_font', pdf_font) # Default to main font if not set
-pdf_code_font = config.get('pdf_code_font', 'Noto Sans Mono') # Good default
-
-for policy_item in POLICY_FILES_LIST:
-    try:
-        policy_filename = policy_item['source']
-        output_filename_template = policy_item['output']
-        # Get the new 'title' field, default to the output filename
-        policy_title_template = policy_item.get('title', output_filename_template.replace('.md', ''))
-    except (TypeError, KeyError):
-        print(f"  -> WARNING: Skipping malformed item in {order_file}. Must be a list of objects with 'source' and 'output' keys.")
-        print(f"     Item: {policy_item}")
-        continue
-        
-    # Render the *output* filename
-    filename_template = Template(output_filename_template)
-    rendered_filename = filename_template.render(config)
-    
-    # Render the *PDF title*
-    title_template = Template(policy_title_template)
-    rendered_title = title_template.render(config)
-
-    print(f"Processing: {policy_filename}  ->  Output: {rendered_filename}  (Title: {rendered_title})")
-
-    try:
-        # 1. Render Jinja2 template (use the *source* filename)
-        template = env.get_template(policy_filename)
-        rendered_content = template.render(config)
-        
-        # 2. Generate history table (use *source* filename to look up)
-        history_table = get_history_table(policy_filename)
-        
-        # 3. Apply history based on config toggles
-        md_content = rendered_content
-        if config.get('md_show_revision_history', False):
-            md_content += history_table
-        
-        pdf_content = rendered_content
-        if config.get('pdf_show_revision_history', False):
-            pdf_content += history_table
-            
-        combined_content = rendered_content
-        if config.get('combined_pdf_show_revision_history', False):
-            combined_content += history_table
-
-        # 5. Save Processed Markdown
-        md_path = os.path.join(md_output_dir, rendered_filename)
-        with open(md_path, 'w') as out_f:
-            out_f.write(md_content)
-
-        # 6. Create Individual PDF
-        pdf_filename = rendered_filename.replace('.md', '.pdf')
-        pdf_path = os.path.join(pdf_output_dir, pdf_filename)
-        
-        print(f"  -> Converting to individual PDF: {pdf_path}")
-        
-        pandoc_cmd_individual = [
-            'pandoc',
-            '--from=gfm', # Use GitHub Flavored Markdown (fixes bullets)
-            '-o', pdf_path,
-            '--metadata', f"title={rendered_title}", # Use friendly title
-            '--variable', f"mainfont={pdf_font}",
-            '--variable', f"sansfont={pdf_header_font}", # Set header font
-            '--variable', f"monofont={pdf_code_font}"  # Set code font
-        ]
-        
-        subprocess.run(
-            pandoc_cmd_individual,
-            input=pdf_content.encode('utf-8'),
-            check=True
-        )
-        
-        # 7. Save file for Combined PDF
-        temp_combined_path = os.path.join(temp_combined_dir, rendered_filename)
-        with open(temp_combined_path, 'w') as out_f:
-            out_f.write(combined_content)
-        processed_for_combined_pdf.append(temp_combined_path)
-
-    except Exception as e:
-        # This will catch the 'template not found' error if the source file is wrong
-        print(f"ERROR processing {policy_filename}: {e}")
-        exit(1)
-
-# --- 8. Create Final Combined PDF ---
-combined_pdf_path = os.path.join(pdf_output_dir, 'combined_policies.pdf')
-print(f"Creating combined PDF: {combined_pdf_path}")
-
-combined_pdf_title = config.get('combined_pdf_title', 'Company Policy Manual')
-combined_pdf_author = config.get('combined_pdf_author', config.get('company_name', 'Company'))
-
-try:
-    pandoc_cmd_combined = [
-        'pandoc',
-        '--from=gfm', # Use GitHub Flavored Markdown (fixes bullets)
-        '-o', combined_pdf_path,
-        '--table-of-contents',
-        '--toc-depth=2',
-        '--number-sections',
-        '--metadata', f"title={combined_pdf_title}",
-        '--metadata', f"author={combined_pdf_author}",
-        '--variable', f"mainfont={pdf_font}",
-        '--variable', f"sansfont={pdf_header_font}",
-        '--variable', f"monofont={pdf_code_font}"
-    ] + processed_for_combined_pdf
-    
-    subprocess.run(pandoc_cmd_combined, check=True)
-    
-except Exception as e:
-    print(f"ERROR creating combined PDF: {e}")
-    exit(1)
-
-print("Policy build process completed successfully.")